@@ -0,0 +1,201 @@
+#!/usr/bin/python
+# coding: utf-8
+
+"""
+Benchmark of the mooring read/QC/plot pipeline on synthetic data.
+
+Synthetic CF-compliant mooring files (with the standard names and the
+ancillary variables expected by Mooring.get_from_nc) are generated locally
+for the requested durations and sampling intervals. Each stage of the
+pipeline is timed and its peak memory measured, and the results are saved
+as JSON so that they can be compared with those of a previous run:
+
+    python benchmark.py --durations 30 365 --intervals 600 60 --output new.json
+    python benchmark.py --compare old.json new.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import netCDF4
+import matplotlib as mpl
+mpl.use('Agg')
+import matplotlib.pyplot as plt
+import mooring
+
+
+def make_synthetic_file(filename, start, duration, interval, seed=0):
+    """
+    Write a synthetic mooring file covering `duration` days from the
+    datetime `start`, with a measurement every `interval` seconds
+    """
+    rng = np.random.default_rng(seed)
+    ntime = int(duration * 86400 // interval)
+    time = mooring.as_epoch(start) + interval * np.arange(ntime, dtype=np.int64)
+    angle = mooring.date2angle(time)
+    with netCDF4.Dataset(filename, "w") as nc:
+        nc.createDimension("time", ntime)
+        timevar = nc.createVariable("time", "f8", ("time",))
+        timevar.standard_name = "time"
+        timevar.units = mooring.EPOCH_UNITS
+        timevar.calendar = "standard"
+        timevar[:] = time
+        for name, standard_name, units, mean, amplitude in [
+                ("WTR_TEM_SBE37", "sea_water_temperature", "C", 20., 6.),
+                ("SALT_SBE37", "sea_water_salinity", "psu", 37.5, 0.3)]:
+            var = nc.createVariable(name, "f4", ("time",), fill_value=np.float32(-9999.))
+            var.standard_name = standard_name
+            var.units = units
+            var.ancillary_variables = "QC_" + name
+            var[:] = (mean - amplitude * np.cos(angle - 0.6)
+                      + 0.2 * rng.standard_normal(ntime)).astype(np.float32)
+            qcvar = nc.createVariable("QC_" + name, "i1", ("time",), fill_value=np.int8(-127))
+            qcvar.standard_name = standard_name + " status_flag"
+            qcvar.flag_values = np.array([0, 1, 2, 3, 4, 6, 9], dtype=np.int8)
+            qcvar.flag_meanings = ("no_qc_performed good_data probably_good_data "
+                                   "probably_bad_data bad_data spike missing_value")
+            flags = np.ones(ntime, dtype=np.int8)
+            flags[rng.integers(0, ntime, ntime // 100)] = 4
+            qcvar[:] = flags
+    return filename
+
+
+def measure(func, setup=None, repeat=3):
+    """
+    Run `func` `repeat` times, return the list of durations (s),
+    the peak of memory allocated (bytes) and the last result.
+    If provided, `setup` is called (untimed) before each run and
+    its result is passed to `func`.
+
+    The runs are timed without tracing the allocations (tracemalloc slows
+    down the code allocating many objects); the peak of memory is measured
+    in one more, untimed run.
+    """
+    durations = []
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        t0 = time.perf_counter()
+        result = func(*args)
+        durations.append(time.perf_counter() - t0)
+    args = () if setup is None else (setup(),)
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return durations, peak, result
+
+
+def run_case(workdir, duration, interval, repeat=3):
+    """
+    Time all the stages of the pipeline for a file of `duration` days
+    sampled every `interval` seconds
+    """
+    filename = os.path.join(workdir, "synthetic_{0}d_{1}s.nc".format(duration, interval))
+    make_synthetic_file(filename, datetime.datetime(2016, 1, 1), duration, interval)
+    year = 2016
+
+    def read():
+        return mooring.Mooring().get_from_nc(filename, strict=True)
+
+    def checked():
+        m = read()
+        m.apply_qc()
+        return m
+
+    def plot(m):
+        fig, ax = plt.subplots(figsize=(15, 8))
+        m.addT_to_plot(year, label=year, decimate=True)
+        m.format_plot(ax, year, 1, 12, title="Benchmark")
+        fig.savefig(os.path.join(workdir, "benchmark.png"), dpi=100)
+        plt.close(fig)
+
+    # Each stage is run on a fresh Mooring, prepared by the untimed setup
+    stages = [("get_from_nc", None, read),
+              ("apply_qc", read, lambda m: m.apply_qc()),
+              ("special_qc", checked, lambda m: m.special_qc()),
+              ("transf_dates", checked, lambda m: m.transf_dates(year)),
+              ("get_max_value", checked, lambda m: m.get_max_value()),
+              ("get_statistics", checked, lambda m: m.get_statistics(by="month")),
+              ("plot", checked, plot)]
+
+    size = len(read().time)
+    results = []
+    for stage, setup, func in stages:
+        durations, peak, _ = measure(func, setup, repeat)
+        results.append({"duration": duration,
+                        "interval": interval,
+                        "size": size,
+                        "stage": stage,
+                        "time_min": min(durations),
+                        "time_median": statistics.median(durations),
+                        "peak_memory": peak})
+        print("{0:>6} days {1:>5} s {2:>15}: {3:8.4f} s {4:10.1f} kB".format(
+            duration, interval, stage, min(durations), peak / 1024.))
+    os.remove(filename)
+    return results
+
+
+def compare(oldfile, newfile, tolerance=0.1):
+    """
+    Print the relative change of the stage durations between two result files
+    and return the list of the cases slower by more than `tolerance`
+    """
+    with open(oldfile) as f:
+        old = {(r["duration"], r["interval"], r["stage"]): r for r in json.load(f)["results"]}
+    with open(newfile) as f:
+        new = json.load(f)["results"]
+    regressions = []
+    for result in new:
+        key = (result["duration"], result["interval"], result["stage"])
+        if key not in old:
+            continue
+        change = result["time_min"] / old[key]["time_min"] - 1
+        print("{0:>6} days {1:>5} s {2:>15}: {3:+7.1%}".format(key[0], key[1], key[2], change))
+        if change > tolerance:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the mooring pipeline")
+    parser.add_argument("--durations", type=int, nargs="+", default=[31, 365],
+                        help="durations of the synthetic files (days)")
+    parser.add_argument("--intervals", type=int, nargs="+", default=[600, 60],
+                        help="sampling intervals (seconds)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(*args.compare)
+        print("{0} regressions".format(len(regressions)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for duration in args.durations:
+            for interval in args.intervals:
+                results += run_case(workdir, duration, interval, args.repeat)
+
+    with open(args.output, "w") as f:
+        json.dump({"date": datetime.datetime.now().isoformat(),
+                   "environment": {"python": platform.python_version(),
+                                   "numpy": np.__version__,
+                                   "netCDF4": netCDF4.__version__,
+                                   "matplotlib": mpl.__version__,
+                                   "machine": platform.machine()},
+                   "results": results}, f, indent=1)
+
+if __name__ == "__main__":
+    main()
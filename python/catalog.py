@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# coding: utf-8
+
+"""
+Discovery of the monthly mooring files, from a THREDDS catalog or from a
+local directory tree.
+
+The file names, such as
+dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2014-06.nc,
+give the deployment, the station, the instrument, the processing level,
+the year and the month.
+The resulting index is kept in memory for the queries and can be saved
+as JSON, to avoid browsing the catalog at each run.
+"""
+
+import collections
+import json
+import logging
+import os
+import re
+import time
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+
+CatalogEntry = collections.namedtuple("CatalogEntry", ["station", "instrument", "deployment",
+                                                       "level", "year", "month", "url"])
+
+filepattern = re.compile(r"dep(?P<deployment>\d+)_(?P<platform>[a-z]+)-(?P<station>[a-z0-9]+)_"
+                         r"(?P<sensor>[a-z]+)-(?P<instrument>[a-z0-9]+)_(?P<level>L\d)_"
+                         r"(?P<year>\d{4})-(?P<month>\d{2})\.nc$")
+
+THREDDS_NS = "{http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0}"
+XLINK_NS = "{http://www.w3.org/1999/xlink}"
+
+
+def parse_filename(url):
+    """
+    Return the CatalogEntry corresponding to a file name or URL,
+    or None if the name does not follow the convention
+    """
+    match = filepattern.search(url)
+    if match is None:
+        return None
+    return CatalogEntry(match.group("station"), match.group("instrument"),
+                        int(match.group("deployment")), match.group("level"),
+                        int(match.group("year")), int(match.group("month")), url)
+
+
+def _month(date):
+    """
+    Return the (year, month) of a date, or of a (year, month) tuple
+    """
+    if date is None or isinstance(date, tuple):
+        return date
+    return (date.year, date.month)
+
+
+class Catalog(object):
+    """
+    Index of the available (station, instrument, deployment, year, month) files
+    """
+
+    def __init__(self, entries=()):
+        self.entries = []
+        self.bystation = {}
+        self.created = time.time()
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        self.entries.append(entry)
+        self.bystation.setdefault(entry.station, []).append(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def from_directory(cls, rootdir):
+        """
+        Build the index from the netCDF files found under `rootdir`
+        """
+        catalog = cls()
+        for dirpath, dirnames, filenames in os.walk(rootdir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                entry = parse_filename(os.path.join(dirpath, filename))
+                if entry is not None:
+                    catalog.add(entry)
+        return catalog
+
+    @classmethod
+    def from_thredds(cls, catalogurl, dapbase=None, follow=True):
+        """
+        Build the index from a THREDDS catalog (URL or local XML file).
+
+        The OPeNDAP URLs are built with the base of the OPeNDAP service
+        declared in the catalog, or `dapbase` if provided. The references
+        to other catalogs are followed if `follow` is True.
+        """
+        catalog = cls()
+        tovisit = [catalogurl]
+        visited = set()
+        while tovisit:
+            url = tovisit.pop(0)
+            if url in visited:
+                continue
+            visited.add(url)
+            root = _read_xml(url)
+
+            base = dapbase
+            if base is None:
+                for service in root.iter(THREDDS_NS + "service"):
+                    if service.get("serviceType", "").lower() == "opendap":
+                        base = urllib.parse.urljoin(url, service.get("base"))
+                        break
+            if base is None:
+                raise ValueError('No OPeNDAP service in {0}'.format(url))
+
+            for dataset in root.iter(THREDDS_NS + "dataset"):
+                urlpath = dataset.get("urlPath")
+                if urlpath is None:
+                    continue
+                entry = parse_filename(base + urlpath)
+                if entry is not None:
+                    catalog.add(entry)
+            if follow:
+                for ref in root.iter(THREDDS_NS + "catalogRef"):
+                    tovisit.append(urllib.parse.urljoin(url, ref.get(XLINK_NS + "href")))
+        return catalog
+
+    def save(self, filename):
+        """
+        Write the index to a JSON file
+        """
+        with open(filename + ".tmp", "w") as f:
+            json.dump({"created": self.created,
+                       "entries": [list(entry) for entry in self.entries]}, f)
+        os.replace(filename + ".tmp", filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read an index written by `save`
+        """
+        with open(filename) as f:
+            data = json.load(f)
+        catalog = cls(CatalogEntry(*entry) for entry in data["entries"])
+        catalog.created = data["created"]
+        return catalog
+
+    def query(self, station=None, start=None, end=None, months=None, instrument=None,
+              exclude=None, level="L1"):
+        """
+        Return the entries of the station between the dates `start` and `end`
+        (or (year, month) tuples, both included), sorted by date.
+        `months` restricts the entries to some months of the year, and the
+        files present in `exclude` (e.g. a MooringCache) are left out.
+        Only the files of the processing `level` are returned (all the
+        levels if it is None), so that the files of different levels
+        are never merged.
+        """
+        start, end = _month(start), _month(end)
+        entries = self.entries if station is None else self.bystation.get(station, [])
+        selection = [entry for entry in entries
+                     if (start is None or (entry.year, entry.month) >= start)
+                     and (end is None or (entry.year, entry.month) <= end)
+                     and (months is None or entry.month in months)
+                     and (instrument is None or entry.instrument == instrument)
+                     and (level is None or entry.level == level)
+                     and (exclude is None or entry.url not in exclude)]
+        return sorted(selection, key=lambda entry: (entry.year, entry.month, entry.deployment))
+
+    def files(self, *args, **kwargs):
+        """
+        Return the URLs of the entries selected by `query`
+        """
+        return [entry.url for entry in self.query(*args, **kwargs)]
+
+
+def _read_xml(url):
+    """
+    Parse the XML document at `url` (remote or local)
+    """
+    logger = logging.getLogger("timeseries_logger")
+    logger.debug('Reading catalog {0}'.format(url))
+    if urllib.parse.urlparse(url).scheme in ("http", "https"):
+        with urllib.request.urlopen(url) as response:
+            return ET.fromstring(response.read())
+    return ET.parse(url).getroot()
+
+
+def get_catalog(source, indexfile=None, maxage=86400., **kwargs):
+    """
+    Return the catalog of `source` (THREDDS catalog or local directory),
+    read from `indexfile` if it is less than `maxage` seconds old.
+    The other arguments are passed to `Catalog.from_thredds`.
+    """
+    logger = logging.getLogger("timeseries_logger")
+    if indexfile is not None and os.path.exists(indexfile):
+        catalog = Catalog.load(indexfile)
+        if time.time() - catalog.created < maxage:
+            logger.debug('Using catalog index {0}'.format(indexfile))
+            return catalog
+
+    if os.path.isdir(source):
+        catalog = Catalog.from_directory(source)
+    else:
+        catalog = Catalog.from_thredds(source, **kwargs)
+    logger.info('{0} files found in {1}'.format(len(catalog), source))
+    if indexfile is not None:
+        catalog.save(indexfile)
+    return catalog
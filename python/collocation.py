@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# coding: utf-8
+
+"""
+Collocation of the mooring time series with a gridded field
+(see sstOceanColor), e.g. to validate satellite or model SST with the buoys.
+
+The grid indices and the interpolation weights of the stations are computed
+once for a grid and a set of positions, and kept in a lookup shared by all
+the files on the same grid. The values at all the stations are then read
+with a single request per chunk of time steps, restricted to the rows and
+columns of the grid surrounding the stations.
+"""
+
+import collections
+import hashlib
+import logging
+import numpy as np
+
+_lookups = {}
+
+
+def axis_weights(axis, x):
+    """
+    Return the indices of the points of the increasing `axis` surrounding
+    each of the positions `x`, and the weight of the second point
+    (the positions outside the axis take the value of the closest point)
+    """
+    if len(axis) == 1:
+        zeros = np.zeros(len(x), dtype=np.int64)
+        return zeros, zeros, np.zeros(len(x))
+    i0 = np.clip(np.searchsorted(axis, x, side="right") - 1, 0, len(axis) - 2)
+    weight = np.clip((x - axis[i0]) / (axis[i0 + 1] - axis[i0]), 0., 1.)
+    return i0, i0 + 1, weight
+
+
+def get_lookup(lon, lat, positions, method="bilinear"):
+    """
+    Return the indices of longitude and latitude (one column per grid
+    point used) and the weights of the grid points for each of the
+    positions (lon, lat), for the "nearest" or "bilinear" interpolation,
+    and whether each position is within the grid ("valid").
+
+    The result is kept for the next calls with the same grid and positions.
+    """
+    if method not in ("nearest", "bilinear"):
+        raise ValueError('Unknown method: {0}'.format(method))
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    key = hashlib.sha1(lon.tobytes() + lat.tobytes() + positions.tobytes()
+                       + method.encode("utf-8")).hexdigest()
+    if key in _lookups:
+        return _lookups[key]
+
+    # Longitudes expressed from the first one of the grid, adding the
+    # first point after the last one when the grid covers the globe
+    lonaxis = lon[0] + np.mod(lon - lon[0], 360.)
+    lonindex = np.arange(len(lon))
+    if len(lon) > 1 and lonaxis[-1] + (lonaxis[1] - lonaxis[0]) >= lon[0] + 360. - 1e-6:
+        lonaxis = np.append(lonaxis, lon[0] + 360.)
+        lonindex = np.append(lonindex, 0)
+    # The positions west of a regional grid are east of its last longitude
+    x = lon[0] + np.mod(positions[:, 0] - lon[0], 360.)
+    valid = ((x <= lonaxis[-1]) & (positions[:, 1] >= lat.min())
+             & (positions[:, 1] <= lat.max()))
+    i0, i1, wx = axis_weights(lonaxis, x)
+    i0, i1 = lonindex[i0], lonindex[i1]
+
+    # The latitudes can be decreasing
+    latorder = np.argsort(lat, kind="stable")
+    j0, j1, wy = axis_weights(lat[latorder], positions[:, 1])
+    j0, j1 = latorder[j0], latorder[j1]
+
+    if method == "nearest":
+        lookup = {"lonindex": np.where(wx < 0.5, i0, i1)[:, None],
+                  "latindex": np.where(wy < 0.5, j0, j1)[:, None],
+                  "weights": np.ones((len(positions), 1)),
+                  "valid": valid}
+    else:
+        lookup = {"lonindex": np.stack([i0, i1, i0, i1], axis=1),
+                  "latindex": np.stack([j0, j0, j1, j1], axis=1),
+                  "weights": np.stack([(1 - wx) * (1 - wy), wx * (1 - wy),
+                                       (1 - wx) * wy, wx * wy], axis=1),
+                  "valid": valid}
+    _lookups[key] = lookup
+    return lookup
+
+
+class Collocation(object):
+    """
+    Values of a gridded field at the positions of a set of stations
+
+    `stations` is a dictionary of Mooring objects (e.g. the
+    MooringCollection of each station), of which the attributes
+    `longitude` and `latitude` give the position.
+    """
+
+    def __init__(self, field, stations, method="bilinear"):
+        self.field = field
+        self.stations = collections.OrderedDict(stations)
+        positions = np.array([[m.longitude, m.latitude] for m in self.stations.values()],
+                             dtype=np.float64).reshape(-1, 2)
+        if np.any(np.isnan(positions)):
+            missing = [name for name, m in self.stations.items()
+                       if np.isnan(m.longitude) or np.isnan(m.latitude)]
+            raise ValueError('No position for {0}'.format(", ".join(missing)))
+        self.method = method
+        self.lookup = get_lookup(field.lon, field.lat, positions, method)
+
+        # Rows and columns of the grid to read, and position of the
+        # points of each station among them
+        self.lonread, lonpos = np.unique(self.lookup["lonindex"], return_inverse=True)
+        self.latread, latpos = np.unique(self.lookup["latindex"], return_inverse=True)
+        self.lonpos = lonpos.reshape(self.lookup["lonindex"].shape)
+        self.latpos = latpos.reshape(self.lookup["latindex"].shape)
+
+    def extract(self, name, chunksize=10):
+        """
+        Return the values of the variable `name` of the field at the
+        stations, as a masked array (time, station). The grid points
+        that are masked (e.g. land) are left out of the interpolation, and
+        the stations outside the grid are masked.
+        """
+        logger = logging.getLogger("timeseries_logger")
+        field = self.field
+        ntime = max(len(field.time), 1)
+        result = np.ma.masked_all((ntime, len(self.stations)))
+        for start in range(0, ntime, chunksize):
+            period = slice(start, min(start + chunksize, ntime)) if len(field.time) else None
+            logger.debug('Reading {0} for {1} stations'.format(name, len(self.stations)))
+            values = field.read_variable(name, period, self.lonread, self.latread)
+            if values.ndim == 2:
+                values = values[None, :, :]
+            points = values[:, self.latpos, self.lonpos]
+            weights = self.lookup["weights"][None, :, :] * ~np.ma.getmaskarray(points)
+            total = weights.sum(axis=-1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                interpolated = (weights * np.ma.getdata(points)).sum(axis=-1) / total
+            outside = (total == 0) | ~self.lookup["valid"][None, :]
+            result[start:start + len(values)] = np.ma.masked_where(outside, interpolated)
+        return result
+
+    def match(self, name, variable="temperature", freq=None, maxdelta=3600, chunksize=10):
+        """
+        Return, for each station, the times of the field with a measurement
+        and the collocated values of the field and of the Mooring variable.
+
+        If `freq` is given ("hour", "day" or "month"), the field is compared
+        with the mean of the measurements over each period (see
+        `Mooring.resample`); otherwise with the closest measurement, if it
+        is less than `maxdelta` seconds away from the time of the field.
+        """
+        values = self.extract(name, chunksize)
+        fieldtime = self.field.time
+        matches = collections.OrderedDict()
+        for ii, (station, m) in enumerate(self.stations.items()):
+            if freq is not None:
+                m = m.resample(freq, "mean", variables=[variable])
+                keys = fieldtime.astype("datetime64[s]").astype(
+                    {"hour": "datetime64[h]", "day": "datetime64[D]", "month": "datetime64[M]"}[freq])
+                keys = keys.astype("datetime64[s]").astype(np.int64)
+            else:
+                keys = fieldtime
+            measured = getattr(m, variable)
+            index = np.clip(np.searchsorted(m.time, keys), 0, max(len(m.time) - 1, 0))
+            if len(m.time):
+                # Closest measurement among the two surrounding ones
+                before = np.clip(index - 1, 0, None)
+                closer = np.abs(m.time[before] - keys) < np.abs(m.time[index] - keys)
+                index = np.where(closer, before, index)
+                found = (m.time[index] == keys) if freq is not None else \
+                    (np.abs(m.time[index] - keys) <= maxdelta)
+            else:
+                found = np.zeros(len(keys), dtype=bool)
+            found &= ~np.ma.getmaskarray(values[:, ii])
+            if len(m.time):
+                found &= ~np.ma.getmaskarray(measured)[index]
+            matches[station] = {"time": fieldtime[found],
+                                "field": np.ma.getdata(values[:, ii])[found],
+                                variable: np.ma.getdata(measured)[index[found]]}
+        return matches
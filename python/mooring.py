@@ -12,8 +12,14 @@ consecutive years.
 """
 
 import glob
+import sys
 import os
 import shutil
+import concurrent.futures
+import functools
+import hashlib
+import io
+import json
 import numpy as np
 import netCDF4
 import matplotlib as mpl
@@ -23,6 +29,7 @@ from mpl_toolkits.basemap import Basemap
 from matplotlib import colors
 from matplotlib import dates
 import datetime, time, calendar
+import threading
 import locale
 import matplotlib.font_manager as fm
 import matplotlib.image as image
@@ -34,7 +41,8 @@ mpl.rcParams.update({'font.size': 20})
 prop = fm.FontProperties(fname='/home/ctroupin/.fonts/Cube-Regular2.ttf')
 prop = fm.FontProperties(fname="/home/ctroupin/.fonts/Aileron-Regular.otf")
 
-def configure_logging(fname="mooring.log"):
+def configure_logging(fname="mooring.log", timing=False):
+    metrics.enabled = timing
     logger = logging.getLogger("timeseries_logger")
     logger.setLevel(logging.DEBUG)
     # Format for our loglines
@@ -49,49 +57,633 @@ def configure_logging(fname="mooring.log"):
     fh.setLevel(logging.DEBUG)
     fh.setFormatter(formatter)
     logger.addHandler(fh)
+    # The metrics are written as JSON lines in a separate file
+    if timing:
+        metricslogger = logging.getLogger("timeseries_logger.metrics")
+        metricslogger.propagate = False
+        mh = logging.FileHandler(os.path.splitext(fname)[0] + "_metrics.jsonl")
+        mh.setLevel(logging.DEBUG)
+        mh.setFormatter(logging.Formatter("%(message)s"))
+        metricslogger.addHandler(mh)
     return logger
 
 
+class _NullStage(object):
+    """
+    Stage returned when the metrics are disabled: does nothing
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def add(self, **counts):
+        pass
+
+
+_nullstage = _NullStage()
+
+
+class _Stage(object):
+    """
+    Measure the wall time of a stage and collect its counters
+    """
+
+    def __init__(self, metrics, name, counts):
+        self.metrics = metrics
+        self.name = name
+        self.counts = counts
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.record(self.name, time.perf_counter() - self.t0, **self.counts)
+        return False
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+
+class Metrics(object):
+    """
+    Wall time and counters (bytes read, samples, cache hits...) of the
+    stages of a run, logged as JSON lines by "timeseries_logger.metrics"
+    and accumulated for the summary of the run.
+    When disabled, `stage` returns a shared object doing nothing.
+    In the workers of a `MetricsProcessPool`, the lines and totals are
+    kept and sent back to the main process with the result of each task.
+
+        with metrics.stage("read", file=filename) as stage:
+            ...
+            stage.add(bytes=values.nbytes)
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.totals = {}
+        self.buffer = None
+        self.lock = threading.Lock()
+
+    def stage(self, name, **counts):
+        if not(self.enabled):
+            return _nullstage
+        return _Stage(self, name, counts)
+
+    def count(self, name, **counts):
+        """
+        Add counters to a stage without measuring its time (e.g. cache hits)
+        """
+        if self.enabled:
+            self.record(name, None, **counts)
+
+    def record(self, name, elapsed, **counts):
+        line = {"stage": name, "timestamp": round(time.time(), 3), "pid": os.getpid()}
+        if elapsed is not None:
+            line["time"] = round(elapsed, 6)
+        line.update(counts)
+        counts = {key: value for key, value in counts.items()
+                  if isinstance(value, (int, float)) and not(isinstance(value, bool))}
+        counts["calls"] = 1
+        counts["time"] = 0. if elapsed is None else elapsed
+        self.add_totals({name: counts})
+        if self.buffer is not None:
+            self.buffer.append(line)
+        else:
+            logging.getLogger("timeseries_logger.metrics").info(json.dumps(line))
+
+    def add_totals(self, totals):
+        with self.lock:
+            for name, counts in totals.items():
+                total = self.totals.setdefault(name, {"calls": 0, "time": 0.})
+                for key, value in counts.items():
+                    total[key] = total.get(key, 0) + value
+
+    def collect(self):
+        """
+        Return and reset the lines and totals recorded in a worker
+        """
+        with self.lock:
+            collected = {"totals": self.totals, "lines": self.buffer or []}
+            self.totals = {}
+            self.buffer = []
+        return collected
+
+    def merge(self, collected):
+        """
+        Log the lines and add the totals collected in a worker
+        """
+        if not(self.enabled) or not(collected):
+            return
+        metricslogger = logging.getLogger("timeseries_logger.metrics")
+        for line in collected["lines"]:
+            metricslogger.info(json.dumps(line))
+        self.add_totals(collected["totals"])
+
+    def summary(self):
+        """
+        Log and return the totals of all the stages
+        """
+        if self.enabled:
+            logging.getLogger("timeseries_logger.metrics").info(
+                json.dumps({"summary": self.totals}))
+        return self.totals
+
+
+metrics = Metrics()
+
+
+def _init_worker(enabled):
+    """
+    Enable the metrics in a worker of a MetricsProcessPool
+    (whatever the start method of the processes)
+    """
+    metrics.enabled = enabled
+    metrics.totals = {}
+    metrics.buffer = []
+
+
+def _measured(func, *args, **kwargs):
+    """
+    Call the function in a worker and return its result with the metrics
+    recorded, which are attached to the exception if it fails
+    """
+    try:
+        result = func(*args, **kwargs)
+    except Exception as err:
+        err.metrics = metrics.collect()
+        raise
+    return result, metrics.collect()
+
+
+class MetricsProcessPool(concurrent.futures.ProcessPoolExecutor):
+    """
+    Pool of processes in which the metrics are enabled as in the main
+    process, and of which the metrics are merged in those of the main
+    process as soon as each task is done
+    """
+
+    def __init__(self, max_workers=None, mp_context=None):
+        concurrent.futures.ProcessPoolExecutor.__init__(self, max_workers=max_workers,
+                                                        mp_context=mp_context,
+                                                        initializer=_init_worker,
+                                                        initargs=(metrics.enabled,))
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+
+        def done(task):
+            try:
+                result, collected = task.result()
+            except Exception as err:
+                metrics.merge(getattr(err, "metrics", None))
+                future.set_exception(err)
+            else:
+                metrics.merge(collected)
+                future.set_result(result)
+
+        concurrent.futures.ProcessPoolExecutor.submit(self, _measured, fn, *args,
+                                                      **kwargs).add_done_callback(done)
+        return future
+
+
+def timed(name):
+    """
+    Decorator measuring each call of the function as the stage `name`
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not(metrics.enabled):
+                return func(*args, **kwargs)
+            with metrics.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+EPOCH_UNITS = "seconds since 1970-01-01 00:00:00"
+
+_SECONDS = {"second": 1, "seconds": 1, "sec": 1, "secs": 1, "s": 1,
+            "minute": 60, "minutes": 60, "min": 60, "mins": 60,
+            "hour": 3600, "hours": 3600, "hr": 3600, "hrs": 3600, "h": 3600,
+            "day": 86400, "days": 86400, "d": 86400}
+
+
+def num2epoch(values, units):
+    """
+    Convert the time values expressed in the netCDF `units`
+    (e.g. "days since 1950-01-01") into int64 seconds since 1970-01-01
+    """
+    if units == EPOCH_UNITS:
+        return np.asarray(np.ma.getdata(values)).astype(np.int64)
+    step = units.split(" since ")[0]
+    origin = netCDF4.num2date(0, units)
+    origin = calendar.timegm((origin.year, origin.month, origin.day,
+                              origin.hour, origin.minute, origin.second))
+    seconds = np.asarray(np.ma.getdata(values), dtype=np.float64) * _SECONDS[step.strip().lower()]
+    return origin + np.round(seconds).astype(np.int64)
+
+
+def date2epoch(dates):
+    """
+    Convert datetime objects into int64 seconds since 1970-01-01
+    """
+    return np.round(netCDF4.date2num(dates, EPOCH_UNITS)).astype(np.int64)
+
+
+def epoch2date(time):
+    """
+    Convert seconds since 1970-01-01 into datetime objects
+    """
+    return np.asarray(time).astype("datetime64[s]").astype(object)[()]
+
+
+def date2angle(time):
+    """
+    Return the angle (between 0 and 2 pi) corresponding to the time of the
+    year, for times in seconds since 1970-01-01 (or datetime64):
+    the 1st of January at 0:00 returns 0, taking into account leap years
+    """
+    time = np.asarray(time).astype("datetime64[s]")
+    yearstart = time.astype("datetime64[Y]")
+    yearlength = ((yearstart + 1).astype("datetime64[s]") - yearstart).astype(np.float64)
+    return 2 * np.pi * (time - yearstart).astype(np.float64) / yearlength
+
+
+def decimate_minmax(x, y, nbuckets):
+    """
+    Reduce a time series to the minimum and maximum of each of the `nbuckets`
+    intervals of x (e.g. one per pixel), so that the extremes are still drawn.
+    The masked values separating the segments of valid values are kept,
+    so that the gaps also remain visible.
+
+    Return the decimated x and y (masked array)
+    """
+    y = np.ma.asarray(y)
+    if len(y) <= 4 * nbuckets:
+        return x, y
+    values = np.ma.getdata(y)
+    valid = ~np.ma.getmaskarray(y) & np.isfinite(values)
+    xnum = np.asarray(x).astype(np.int64)
+    xmin, xmax = xnum[0], xnum[-1]
+    bucket = (xnum - xmin) * nbuckets // max(xmax - xmin + 1, 1)
+    # A new segment starts after each masked value
+    segment = np.cumsum(~valid)
+
+    index = np.flatnonzero(valid)
+    group = segment[index] * (nbuckets + 1) + bucket[index]
+    sort = np.lexsort((values[index], group))
+    order, group = index[sort], group[sort]
+    newgroup = np.ones(len(group), dtype=bool)
+    newgroup[1:] = group[1:] != group[:-1]
+    starts = np.flatnonzero(newgroup)
+    stops = np.append(starts[1:], len(group)) - 1
+
+    # First masked value of each gap
+    gaps = np.flatnonzero(~valid & np.r_[True, valid[:-1]])
+    keep = np.unique(np.concatenate([order[starts], order[stops], gaps]))
+    return x[keep], y[keep]
+
+
+def as_epoch(date):
+    """
+    Convert a datetime object (or a number of seconds) into seconds since 1970-01-01
+    """
+    if isinstance(date, datetime.datetime):
+        return calendar.timegm(date.timetuple())
+    return int(date)
+
+
+def _write_npy(filename, values, offset=0):
+    """
+    Write the 1-D array `values` to the .npy file `filename` from the
+    position `offset`, keeping the values before it: only the header and
+    the end of the file are written when the file already exists
+    """
+    values = np.ascontiguousarray(values)
+    if offset and os.path.exists(filename):
+        with open(filename, "r+b") as f:
+            version = np.lib.format.read_magic(f)
+            read_header, write_header = {
+                (1, 0): (np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0),
+                (2, 0): (np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0)
+            }[version]
+            shape, fortran, dtype = read_header(f)
+            headersize = f.tell()
+            # The header written by np.save leaves room for the shape to grow
+            header = io.BytesIO()
+            write_header(header, {"descr": np.lib.format.dtype_to_descr(dtype),
+                                  "fortran_order": False, "shape": (offset + len(values),)})
+            if dtype == values.dtype and len(header.getvalue()) == headersize and offset <= shape[0]:
+                f.seek(headersize + offset * dtype.itemsize)
+                f.write(values.tobytes())
+                f.truncate()
+                f.seek(0)
+                f.write(header.getvalue())
+                return
+        values = np.concatenate([np.load(filename)[:offset], values.astype(dtype)])
+    np.save(filename, values)
+
+
+def _lazy_variable(name):
+    """
+    Property storing the variable `name` of a Mooring, read from the file
+    on first access when the Mooring was opened in lazy mode
+    """
+    def getter(self):
+        if name not in self._data:
+            values = self.read_variable(name)
+            if name in self.qcmask:
+                values = np.ma.masked_array(values, mask=self.qcmask[name])
+            self._data[name] = values
+        return self._data[name]
+
+    def setter(self, value):
+        self._data[name] = value
+
+    return property(getter, setter)
+
+
 class Mooring(object):
     """
     Stores the mooring properties and allows for advanced plotting functions
     """
 
+    variables = ["temperature", "temperatureQF", "salinity", "salinityQF"]
+
+    temperature = _lazy_variable("temperature")
+    temperatureQF = _lazy_variable("temperatureQF")
+    salinity = _lazy_variable("salinity")
+    salinityQF = _lazy_variable("salinityQF")
+
     def __init__(self):
         """
         Initialise with empty arrays
         """
+        self._data = {}
+        self._source = None
+        self._nc = None
+        self.qcmask = {}
+        self.qcflags = {}
+        self.qctests = {}
         self.temperature = np.array([])
         self.salinity = np.array([])
-        self.date = np.array([])
+        self.time = np.array([], dtype=np.int64)
+        self._dates = None
         self.temperatureQF = np.array([])
         self.salinityQF = np.array([])
+        self.longitude = np.nan
+        self.latitude = np.nan
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_nc"] = None
+        return state
 
-    def get_from_nc(self, filename):
+    def get_from_nc(self, filename, strict=False, cache=None, lazy=False,
+                    start=None, end=None):
         """
         Read the variables from the specified netCDF file
+
+        If `strict` is True, the errors occurring when the file is opened
+        are raised instead of being logged.
+        If a `MooringCache` is provided, the variables are taken from it
+        when possible and stored in it after being read.
+        Only the measurements between the dates `start` and `end` are kept;
+        the time coordinate is read first to convert them into indices.
+        If `lazy` is True, the file is kept open and the other variables
+        are only read when accessed (see also `window`).
         """
         logger = logging.getLogger("timeseries_logger")
         logger.info('Working on {0}'.format(filename))
+        self.filename = filename
+        if cache is not None and not(lazy):
+            variables = cache.get(filename)
+            if variables is not None:
+                logger.debug('Reading {0} from the cache'.format(filename))
+                metrics.count("cache", hits=1)
+                self.set_variables(variables)
+                period = self.find_period(start, end)
+                self.time = self.time[period]
+                self._data = {name: values[period] for name, values in self._data.items()}
+                return self
+            metrics.count("cache", misses=1)
         try:
-            with netCDF4.Dataset(filename) as nc:
-                # Get the variable names based on the standard names
-                Tvar = nc.get_variables_by_attributes(standard_name="sea_water_temperature")[0]
-                TQFvar = nc.variables[Tvar.ancillary_variables]
-                Svar = nc.get_variables_by_attributes(standard_name="sea_water_salinity")[0]
-                SQFvar = nc.variables[Svar.ancillary_variables]
-                timevar = nc.get_variables_by_attributes(standard_name="time")[0]
-                # Get the values
-                self.temperature = Tvar[:]
-                self.temperatureQF = TQFvar[:]
-                self.salinity = Svar[:]
-                self.salinityQF = SQFvar[:]
-                self.dates = netCDF4.num2date(timevar[:], timevar.units)
-        except RuntimeError:
+            with metrics.stage("open", file=filename):
+                nc = netCDF4.Dataset(filename)
+        except (RuntimeError, OSError):
+            if strict:
+                raise
             logger.error('File {0} does not exist (yet)'.format(filename))
+            return self
+
+        try:
+            # Get the variable names based on the standard names
+            Tvar = nc.get_variables_by_attributes(standard_name="sea_water_temperature")[0]
+            TQFvar = nc.variables[Tvar.ancillary_variables]
+            Svar = nc.get_variables_by_attributes(standard_name="sea_water_salinity")[0]
+            SQFvar = nc.variables[Svar.ancillary_variables]
+            timevar = nc.get_variables_by_attributes(standard_name="time")[0]
+            # Get the time, then the values within the period
+            with metrics.stage("read_time", file=filename) as stage:
+                timevalues = timevar[:]
+                stage.add(bytes=timevalues.nbytes, samples=timevalues.size)
+            with metrics.stage("convert_time", file=filename):
+                self.time = num2epoch(timevalues, timevar.units)
+            period = self.find_period(start, end)
+            self.time = self.time[period]
+            # Position of the station (mean position if it is recorded in time)
+            for name in ["longitude", "latitude"]:
+                variables = nc.get_variables_by_attributes(standard_name=name)
+                if variables:
+                    setattr(self, name, float(np.ma.mean(variables[0][:])))
+            self._source = {"filename": filename,
+                            "period": period,
+                            "names": {"temperature": Tvar.name,
+                                      "temperatureQF": TQFvar.name,
+                                      "salinity": Svar.name,
+                                      "salinityQF": SQFvar.name}}
+            self._data = {}
+            if not(lazy):
+                with metrics.stage("read_variables", file=filename) as stage:
+                    self.temperature = Tvar[period]
+                    self.temperatureQF = TQFvar[period]
+                    self.salinity = Svar[period]
+                    self.salinityQF = SQFvar[period]
+                    stage.add(bytes=sum(np.ma.getdata(values).nbytes for values in self._data.values()),
+                              samples=len(self.time))
+        except Exception:
+            nc.close()
+            raise
+        # The file is only kept open once the lazy reading is set up
+        if lazy:
+            self._nc = nc
+        else:
+            nc.close()
 
+        if cache is not None and not(lazy) and start is None and end is None:
+            cache.put(filename, self.get_variables())
         return self
 
+    def read_variable(self, name, start=None, stop=None):
+        """
+        Read the variable `name` (within the selected period, optionally
+        restricted to the indices `start` to `stop`)
+        from the file of a Mooring opened in lazy mode
+        """
+        if self._source is None:
+            raise ValueError('No file to read {0} from'.format(name))
+        if self._nc is None:
+            self._nc = netCDF4.Dataset(self._source["filename"])
+        logger = logging.getLogger("timeseries_logger")
+        logger.debug('Reading {0} from {1}'.format(name, self._source["filename"]))
+        period = self._source["period"]
+        if start is not None or stop is not None:
+            indices = range(period.start, period.stop)[start:stop]
+            period = slice(indices.start, indices.stop)
+        with metrics.stage("read_variables", file=self._source["filename"], variable=name) as stage:
+            values = self._nc.variables[self._source["names"][name]][period]
+            stage.add(bytes=np.ma.getdata(values).nbytes, samples=values.size)
+        return values
+
+    def get_chunk(self, name, start, stop):
+        """
+        Return the values of the variable `name` between the indices `start`
+        and `stop`, without reading the whole variable if it is not loaded yet
+        """
+        if name in self._data:
+            return self._data[name][start:stop]
+        return self.read_variable(name, start, stop)
+
+    def close(self):
+        """
+        Close the file of a Mooring opened in lazy mode
+        """
+        if self._nc is not None:
+            self._nc.close()
+            self._nc = None
+
+    def find_period(self, start=None, end=None):
+        """
+        Return the slice of the (sorted) time axis between the dates `start`
+        and `end` (both included)
+        """
+        i0 = 0 if start is None else np.searchsorted(self.time, as_epoch(start), side="left")
+        i1 = len(self.time) if end is None else np.searchsorted(self.time, as_epoch(end), side="right")
+        return slice(int(i0), int(i1))
+
+    def window(self, start=None, end=None):
+        """
+        Return a Mooring with the measurements between `start` and `end`.
+        The arrays already read are sliced without copy (except the
+        quality control masks and flags), the other ones are left to be
+        read from the file when accessed.
+        """
+        period = self.find_period(start, end)
+        m = Mooring()
+        m.filename = getattr(self, "filename", None)
+        m.time = self.time[period]
+        m._data = {name: values[period] for name, values in self._data.items()}
+        # The quality control of the window does not modify the Mooring
+        m.qcmask = {name: mask[period].copy() for name, mask in self.qcmask.items()}
+        m.qcflags = {name: flags[period].copy() for name, flags in self.qcflags.items()}
+        m.qctests = {name: list(tests) for name, tests in self.qctests.items()}
+        m.longitude, m.latitude = self.longitude, self.latitude
+        if self._source is not None:
+            offset = self._source["period"].start
+            m._source = dict(self._source,
+                             period=slice(offset + period.start, offset + period.stop))
+        return m
+
+    def get_variables(self):
+        """
+        Return a dictionary with the variables read from the file
+        """
+        return {"temperature": self.temperature,
+                "temperatureQF": self.temperatureQF,
+                "salinity": self.salinity,
+                "salinityQF": self.salinityQF,
+                "time": self.time,
+                "timeunits": EPOCH_UNITS,
+                "longitude": self.longitude,
+                "latitude": self.latitude}
+
+    def set_variables(self, variables):
+        """
+        Set the variables from a dictionary built by `get_variables`
+        """
+        self.temperature = variables["temperature"]
+        self.temperatureQF = variables["temperatureQF"]
+        self.salinity = variables["salinity"]
+        self.salinityQF = variables["salinityQF"]
+        self.time = num2epoch(variables["time"], variables.get("timeunits", EPOCH_UNITS))
+        self.longitude = variables.get("longitude", np.nan)
+        self.latitude = variables.get("latitude", np.nan)
+
+    @property
+    def dates(self):
+        """
+        Time as datetime objects, only computed when needed (e.g. for labels):
+        the computations are performed on `time`, in seconds since 1970-01-01
+        """
+        if self._dates is None or self._dates[0] is not self.time:
+            self._dates = (self.time, epoch2date(self.time))
+        return self._dates[1]
+
+    @dates.setter
+    def dates(self, values):
+        self.time = date2epoch(values)
+
+    @classmethod
+    def from_files(cls, file_list, workers=4, cache=None):
+        """
+        Read a list of netCDF files concurrently, using a pool of `workers`
+        processes (the netCDF library is not thread-safe)
+
+        Return the list of Mooring objects, in the same order as `file_list`,
+        and a dictionary with the exception raised for each of the files
+        that could not be read (the corresponding item of the list is None).
+        The files available in the `cache` are not submitted to the pool.
+        """
+        logger = logging.getLogger("timeseries_logger")
+        moorings = [None] * len(file_list)
+        failures = {}
+        toread = []
+        for ii, filename in enumerate(file_list):
+            variables = None if cache is None else cache.get(filename)
+            if variables is None:
+                if cache is not None:
+                    metrics.count("cache", misses=1)
+                toread.append(ii)
+            else:
+                metrics.count("cache", hits=1)
+                moorings[ii] = cls()
+                moorings[ii].filename = filename
+                moorings[ii].set_variables(variables)
+        logger.debug('{0} files found in the cache'.format(len(file_list) - len(toread)))
+
+        if toread:
+            with MetricsProcessPool(max_workers=workers) as pool:
+                futures = {pool.submit(_read_file, cls, file_list[ii]): ii
+                           for ii in toread}
+                for future in concurrent.futures.as_completed(futures):
+                    ii = futures[future]
+                    try:
+                        moorings[ii] = future.result()
+                    except Exception as err:
+                        logger.error('Cannot read {0}: {1}'.format(file_list[ii], err))
+                        failures[file_list[ii]] = err
+                    else:
+                        if cache is not None:
+                            cache.put(file_list[ii], moorings[ii].get_variables())
+        return moorings, failures
+
     def apply_qc(self, qf=1):
         """
         Apply quality control to the data by masking the measurements
@@ -99,27 +691,103 @@ class Mooring(object):
         """
         logger = logging.getLogger("timeseries_logger")
         logger.info('Applying mask to the data')
-        self.temperature = np.ma.masked_where(self.temperatureQF != qf, self.temperature)
-        self.salinity = np.ma.masked_where(self.salinityQF !=qf, self.salinity)
+        QCPipeline([FlagTest(qf)]).run(self)
 
-    def special_qc(self):
-        self.temperature = np.ma.masked_where((self.dates >= datetime.datetime(2018, 6, 12)) &
-                                           (self.dates <= datetime.datetime(2018, 6, 14, 12, 0, 0)),
-                                            self.temperature, copy=True)
+    def special_qc(self, windows=None):
+        """
+        Mask the temperature measured during the given list of (start, end)
+        periods, by default those known to be wrong
+        """
+        if windows is None:
+            windows = [(datetime.datetime(2018, 6, 12), datetime.datetime(2018, 6, 14, 12, 0, 0))]
+        QCPipeline([BlackoutTest(windows)]).run(self, variables=["temperature"])
 
     def transf_dates(self, yearmin):
-        transfdates = np.array([dd.replace(year=int(yearmin)) for dd in self.dates])
-        return transfdates
+        """
+        Shift the dates to the year `yearmin` (as datetime64), keeping
+        the month and the time elapsed since the beginning of the month
+        (the 29th of February becomes the 1st of March in common years)
+        """
+        time = self.time.astype("datetime64[s]")
+        month = time.astype("datetime64[M]")
+        return (np.datetime64(str(int(yearmin)), "M") + (month - month.astype("datetime64[Y]"))
+                + (time - month))
 
-    def addT_to_plot(self, yearmin, label=None, color="k", linewidth=2, linestyle="-"):
-        transfdates = self.transf_dates(yearmin)
-        plt.plot(transfdates, self.temperature, label=label,
-                color=color, linewidth=linewidth, linestyle=linestyle)
-        
-    def addS_to_plot(self, yearmin, label=None, color="k", linewidth=2, linestyle="-"):
+    def addT_to_plot(self, yearmin, label=None, color="k", linewidth=2, linestyle="-",
+                     decimate=False):
+        """
+        Plot the temperature, shifted to the year `yearmin`.
+        If `decimate` is True, only the minimum and maximum per pixel of the
+        current axes are drawn (an integer sets the number of intervals).
+        """
+        self.add_to_plot("temperature", yearmin, label=label, color=color,
+                         linewidth=linewidth, linestyle=linestyle, decimate=decimate)
+
+    def addS_to_plot(self, yearmin, label=None, color="k", linewidth=2, linestyle="-",
+                     decimate=False):
+        """
+        Plot the salinity, shifted to the year `yearmin` (see `addT_to_plot`)
+        """
+        self.add_to_plot("salinity", yearmin, label=label, color=color,
+                         linewidth=linewidth, linestyle=linestyle, decimate=decimate)
+
+    def add_to_plot(self, name, yearmin, label=None, color="k", linewidth=2, linestyle="-",
+                    decimate=False):
         transfdates = self.transf_dates(yearmin)
-        plt.plot(transfdates, self.salinity, label=label,
-                color=color, linewidth=linewidth, linestyle=linestyle)
+        values = getattr(self, name)
+        if decimate:
+            if decimate is True:
+                decimate = int(np.ceil(plt.gca().bbox.width))
+            transfdates, values = decimate_minmax(transfdates, values, decimate)
+        plt.plot(transfdates, values, label=label,
+                 color=color, linewidth=linewidth, linestyle=linestyle)
+
+    def add_to_polar(self, name, ax, colors=None, linewidth=2, linestyle="-", decimate=False):
+        """
+        Plot the variable `name` on polar axes, the angle being the time of
+        the year, with one line per year (labelled by the year).
+        `colors` is a dictionary giving the color of each year.
+        """
+        years = self.group_keys("year")
+        starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]]) if len(years) else []
+        stops = np.append(starts[1:], len(years))
+        for start, stop in zip(starts, stops):
+            time, values = self.time[start:stop], getattr(self, name)[start:stop]
+            if decimate:
+                if decimate is True:
+                    decimate = int(np.ceil(ax.bbox.width))
+                time, values = decimate_minmax(time, values, decimate)
+            color = None if colors is None else colors.get(years[start])
+            ax.plot(date2angle(time), values, label=years[start], color=color,
+                    linewidth=linewidth, linestyle=linestyle)
+
+    def addT_to_polar(self, ax, colors=None, linewidth=2, linestyle="-", decimate=False):
+        """
+        Plot the temperature on polar axes (see `add_to_polar`)
+        """
+        self.add_to_polar("temperature", ax, colors=colors, linewidth=linewidth,
+                          linestyle=linestyle, decimate=decimate)
+
+    def addS_to_polar(self, ax, colors=None, linewidth=2, linestyle="-", decimate=False):
+        """
+        Plot the salinity on polar axes (see `add_to_polar`)
+        """
+        self.add_to_polar("salinity", ax, colors=colors, linewidth=linewidth,
+                          linestyle=linestyle, decimate=decimate)
+
+    def format_polar(self, ax, title=None, prop=None):
+        """
+        Format the polar axes: January at the top, months clockwise
+        """
+        ax.set_theta_zero_location("N")
+        ax.set_theta_direction(-1)
+        monthstart = np.arange("2001-01", "2002-01", dtype="datetime64[M]")
+        ax.set_xticks(date2angle(monthstart))
+        ax.set_xticklabels([calendar.month_abbr[mm] for mm in range(1, 13)], fontproperties=prop)
+        for label in ax.get_yticklabels():
+            label.set_fontproperties(prop)
+        ax.set_title(title, fontproperties=prop, fontsize=20)
+        ax.legend(loc=4, prop=prop)
 
     def format_plot(self, ax, yearmin, monthmin, monthmax, title=None, prop=None):
         """
@@ -137,125 +805,1037 @@ class Mooring(object):
             label.set_fontproperties(prop)
 
         plt.title(title, fontproperties=prop, fontsize=20)
-        transfdates = self.transf_dates(yearmin)
         ax.set_xlim(datetime.datetime(yearmin, monthmin, 1),
-                    datetime.datetime(yearmin, monthmax + 1, 1))
+                    datetime.datetime(yearmin + monthmax // 12, monthmax % 12 + 1, 1))
         plt.tick_params(axis='both', which='major', labelsize=16)
         plt.tick_params(axis='both', which='minor', labelsize=16)
         #fig.autofmt_xdate()
         hl = plt.legend(loc=4, prop=prop)
         plt.grid()
 
+    def group_keys(self, by=None):
+        """
+        Return the group of each measurement, according to `by`:
+        None (a single group), "year", "month", "day", "hour" or "dayofyear" (1 to 366)
+        """
+        time = self.time.astype("datetime64[s]")
+        if by is None:
+            return np.zeros(len(time), dtype=np.int64)
+        elif by == "year":
+            return time.astype("datetime64[Y]").astype(np.int64) + 1970
+        elif by == "month":
+            return time.astype("datetime64[M]")
+        elif by == "day":
+            return time.astype("datetime64[D]")
+        elif by == "hour":
+            return time.astype("datetime64[h]")
+        elif by == "dayofyear":
+            day = time.astype("datetime64[D]")
+            return (day - day.astype("datetime64[Y]")).astype(np.int64) + 1
+        raise ValueError('Unknown grouping: {0}'.format(by))
+
+    def get_statistics(self, by=None, percentiles=(5, 50, 95),
+                       variables=("temperature", "salinity")):
+        """
+        Compute the statistics of the variables for each group of measurements
+        (see `group_keys`), ignoring the masked values.
+
+        Return a dictionary with the group keys ("keys") and, for each
+        variable, a dictionary with the arrays "count", "min", "max", "mean",
+        "datemin", "datemax" (datetime64) and "percentiles" (one column per
+        percentile). Each variable is sorted once by group and value, all the
+        statistics are then read from the sorted array.
+        To process several files at once, use a `MooringCollection`.
+        """
+        keys = self.group_keys(by)
+        groups, groupindex = np.unique(keys, return_inverse=True)
+        ngroups = len(groups)
+        percentiles = np.asarray(percentiles, dtype=np.float64)
+        statistics = {"keys": groups}
+        for name in variables:
+            field = getattr(self, name)
+            values = np.ma.getdata(field).astype(np.float64)
+            valid = ~np.ma.getmaskarray(field) & np.isfinite(values)
+            values = values[valid]
+            group = groupindex[valid]
+            time = self.time[valid]
+
+            order = np.lexsort((values, group))
+            values, group, time = values[order], group[order], time[order]
+            newgroup = np.ones(len(group), dtype=bool)
+            newgroup[1:] = group[1:] != group[:-1]
+            starts = np.flatnonzero(newgroup)
+            stops = np.append(starts[1:], len(group))
+            count = stops - starts
+            present = group[starts]
+
+            result = {"count": np.zeros(ngroups, dtype=np.int64),
+                      "min": np.full(ngroups, np.nan),
+                      "max": np.full(ngroups, np.nan),
+                      "mean": np.full(ngroups, np.nan),
+                      "datemin": np.full(ngroups, np.datetime64("NaT"), dtype="datetime64[s]"),
+                      "datemax": np.full(ngroups, np.datetime64("NaT"), dtype="datetime64[s]"),
+                      "percentiles": np.full((ngroups, len(percentiles)), np.nan)}
+            if len(starts):
+                result["count"][present] = count
+                result["min"][present] = values[starts]
+                result["max"][present] = values[stops - 1]
+                result["mean"][present] = np.add.reduceat(values, starts) / count
+                result["datemin"][present] = time[starts]
+                result["datemax"][present] = time[stops - 1]
+                # Linear interpolation between the closest ranks
+                position = starts[:, None] + percentiles[None, :] / 100. * (count[:, None] - 1)
+                lower = np.floor(position).astype(np.int64)
+                upper = np.ceil(position).astype(np.int64)
+                weight = position - lower
+                result["percentiles"][present] = (1 - weight) * values[lower] + weight * values[upper]
+            statistics[name] = result
+        return statistics
+
+    def resample(self, freq="day", how="mean", variables=("temperature", "salinity")):
+        """
+        Aggregate the measurements by "hour", "day" or "month", ignoring the
+        masked values, with `how` among "mean", "min", "max" and "count".
+
+        Return a Mooring of which the time is the start of each period
+        containing measurements and the variables are the aggregates,
+        masked for the periods without valid values. The number of valid
+        values of each period is also given in the attribute `counts`, and
+        the quality flags are set to 1 (good) or 9 (missing value).
+        """
+        if how not in ("mean", "min", "max", "count"):
+            raise ValueError('Unknown aggregation: {0}'.format(how))
+        if freq not in ("hour", "day", "month"):
+            raise ValueError('Unknown frequency: {0}'.format(freq))
+        keys = self.group_keys(freq)
+        order = None
+        if np.any(keys[1:] < keys[:-1]):
+            order = np.argsort(keys, kind="stable")
+            keys = keys[order]
+        newgroup = np.ones(len(keys), dtype=bool)
+        newgroup[1:] = keys[1:] != keys[:-1]
+        starts = np.flatnonzero(newgroup)
+
+        m = Mooring()
+        m.filename = getattr(self, "filename", None)
+        m.longitude, m.latitude = self.longitude, self.latitude
+        m.time = keys[starts].astype("datetime64[s]").astype(np.int64)
+        m.counts = {}
+        for name in variables:
+            field = getattr(self, name)
+            if order is not None:
+                field = field[order]
+            values = np.ma.getdata(field).astype(np.float64)
+            valid = ~np.ma.getmaskarray(field) & np.isfinite(values)
+            count = np.zeros(len(starts), dtype=np.int64)
+            result = np.full(len(starts), np.nan)
+            if len(starts):
+                count = np.add.reduceat(valid.astype(np.int64), starts)
+                if how == "mean":
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        result = np.add.reduceat(np.where(valid, values, 0.), starts) / count
+                elif how == "min":
+                    result = np.fmin.reduceat(np.where(valid, values, np.nan), starts)
+                elif how == "max":
+                    result = np.fmax.reduceat(np.where(valid, values, np.nan), starts)
+                else:
+                    result = count
+            m.counts[name] = count
+            setattr(m, name, np.ma.masked_array(result, mask=(count == 0)))
+            setattr(m, name + "QF", np.where(count > 0, 1, 9).astype(np.int8))
+        return m
+
     def get_max_value(self, maxT=0.0, datemax=datetime.datetime(1900, 1, 1)):
-        indmax = np.argmax(self.temperature)
-        if self.temperature[indmax] > maxT:
-            maxT = self.temperature[indmax]
-            datemax = self.dates[indmax]
+        statistics = self.get_statistics(percentiles=(), variables=["temperature"])
+        if statistics["temperature"]["max"].size and statistics["temperature"]["max"][0] > maxT:
+            maxT = statistics["temperature"]["max"][0]
+            datemax = statistics["temperature"]["datemax"][0].astype(object)
         return maxT, datemax
-    
+
     def get_max_valueS(self, maxS=0.0, datemax=datetime.datetime(1900, 1, 1)):
-        indmax = np.argmax(self.salinity)
-        if self.salinity[indmax] > maxS:
-            maxS = self.salinity[indmax]
-            datemax = self.dates[indmax]
+        statistics = self.get_statistics(percentiles=(), variables=["salinity"])
+        if statistics["salinity"]["max"].size and statistics["salinity"]["max"][0] > maxS:
+            maxS = statistics["salinity"]["max"][0]
+            datemax = statistics["salinity"]["datemax"][0].astype(object)
         return maxS, datemax
 
+    def to_archive(self, rootdir, station, append=False):
+        """
+        Write the measurements to the archive `rootdir`, in one directory
+        per station and year (replacing the years already archived).
+        With `append`, the measurements are added to those of the years
+        already archived: when they follow the last archived one, they are
+        appended at the end of the files, otherwise the year is merged with
+        them and written again.
 
-def main():
+        Each variable is stored as a .npy file that can be memory-mapped:
+        the values in float32, their mask packed in bits, the quality flags
+        in int8 and the time as int32 differences from the previous value.
+        """
+        logger = logging.getLogger("timeseries_logger")
+        years = self.group_keys("year")
+        for year in np.unique(years):
+            period = np.flatnonzero(years == year)
+            period = slice(period[0], period[-1] + 1)
+            part = self.window(self.time[period.start], self.time[period.stop - 1])
+            yeardir = os.path.join(rootdir, station, str(year))
+            metafile = os.path.join(yeardir, "meta.json")
+            offset = 0
+            if append and os.path.exists(metafile):
+                with open(metafile) as f:
+                    meta = json.load(f)
+                if part.time[0] > meta["end"]:
+                    offset = meta["size"]
+                else:
+                    archived = MooringCollection.from_archive(rootdir, station, years=[int(year)])
+                    part = MooringCollection.from_moorings([archived, part])
+                    del archived
+            if not(os.path.exists(yeardir)):
+                os.makedirs(yeardir)
+            logger.debug('Writing {0} values to {1} from {2}'.format(len(part.time), yeardir, offset))
+            time = part.time
+            previous = meta["end"] if offset else time[0]
+            _write_npy(os.path.join(yeardir, "time.npy"),
+                       np.diff(time, prepend=previous).astype(np.int32), offset)
+            for name in ["temperature", "salinity"]:
+                field = getattr(part, name)
+                _write_npy(os.path.join(yeardir, name + ".npy"),
+                           np.ma.getdata(field).astype(np.float32), offset)
+                # The mask is written again from the byte of the offset
+                maskfile = os.path.join(yeardir, name + "_mask.npy")
+                mask = np.ma.getmaskarray(field)
+                if offset % 8:
+                    packed = np.load(maskfile, mmap_mode="r")[offset // 8:offset // 8 + 1]
+                    mask = np.append(np.unpackbits(packed)[:offset % 8].astype(bool), mask)
+                _write_npy(maskfile, np.packbits(mask), offset // 8)
+                _write_npy(os.path.join(yeardir, name + "QF.npy"),
+                           np.ma.getdata(getattr(part, name + "QF")).astype(np.int8), offset)
+            # The metadata are written last: the values after `size` are
+            # ignored if the writing was interrupted
+            with open(metafile, "w") as f:
+                json.dump({"start": int(time[0]) if not(offset) else meta["start"],
+                           "end": int(time[-1]), "size": offset + len(time),
+                           "longitude": self.longitude, "latitude": self.latitude}, f)
 
-    logger = configure_logging()
-    logger.info('---Starting new run---')
 
-    # File and directory names
+class MooringCollection(Mooring):
+    """
+    Measurements from several files merged in a single set of contiguous,
+    time-sorted arrays
+
+    The attribute `index` gives the slice of the arrays corresponding to
+    each (year, month).
+    """
+
+    def __init__(self):
+        Mooring.__init__(self)
+        self.index = {}
+
+    @classmethod
+    def from_moorings(cls, moorings):
+        """
+        Merge a list of Mooring objects, removing the duplicated time
+        stamps (the first occurrence is kept)
+        """
+        moorings = [m for m in moorings if len(m.time) > 0]
+        collection = cls()
+        if not(moorings):
+            return collection
+
+        alltime = np.concatenate([m.time for m in moorings])
+        order = np.argsort(alltime, kind="stable")
+        sortedtime = alltime[order]
+        keep = np.ones(len(sortedtime), dtype=bool)
+        keep[1:] = sortedtime[1:] != sortedtime[:-1]
+        order = order[keep]
+
+        collection.temperature = np.ma.concatenate([m.temperature for m in moorings])[order]
+        collection.salinity = np.ma.concatenate([m.salinity for m in moorings])[order]
+        collection.temperatureQF = np.concatenate([np.ma.getdata(m.temperatureQF)
+                                                   for m in moorings])[order]
+        collection.salinityQF = np.concatenate([np.ma.getdata(m.salinityQF)
+                                                for m in moorings])[order]
+        collection.time = sortedtime[keep]
+        collection.longitude, collection.latitude = moorings[0].longitude, moorings[0].latitude
+        collection.build_index()
+        return collection
+
+    @classmethod
+    def from_files(cls, file_list, workers=4, cache=None):
+        """
+        Read the files concurrently (see `Mooring.from_files`) and merge them
+
+        Return the collection and the dictionary of failures
+        """
+        moorings, failures = Mooring.from_files(file_list, workers=workers, cache=cache)
+        return cls.from_moorings([m for m in moorings if m is not None]), failures
+
+    @classmethod
+    def from_archive(cls, rootdir, station, years=None, months=None):
+        """
+        Read the measurements of a station written by `Mooring.to_archive`,
+        for all the years available or only the given ones, optionally
+        restricted to some months of the year.
+        The values and quality flags are memory-mapped (read-only) when a
+        single year (or consecutive months of a year) is read; the years
+        are otherwise concatenated in memory.
+        """
+        stationdir = os.path.join(rootdir, station)
+        collection = cls()
+        if years is None:
+            years = sorted(int(year) for year in os.listdir(stationdir) if year.isdigit())
+        parts = {name: [] for name in ["time"] + Mooring.variables}
+        masks = {"temperature": [], "salinity": []}
+        for year in years:
+            yeardir = os.path.join(stationdir, str(year))
+            with open(os.path.join(yeardir, "meta.json")) as f:
+                meta = json.load(f)
+            collection.longitude = meta.get("longitude", np.nan)
+            collection.latitude = meta.get("latitude", np.nan)
+            delta = np.load(os.path.join(yeardir, "time.npy"), mmap_mode="r")[:meta["size"]]
+            time = meta["start"] + np.cumsum(delta, dtype=np.int64)
+            period = slice(0, meta["size"])
+            if months is not None:
+                period = np.flatnonzero(np.isin(time.astype("datetime64[s]").astype("datetime64[M]")
+                                                .astype(np.int64) % 12 + 1, months))
+                # Consecutive months are a slice of the year (no copy)
+                if len(period) and period[-1] - period[0] + 1 == len(period):
+                    period = slice(period[0], period[-1] + 1)
+            parts["time"].append(time[period])
+            for name in Mooring.variables:
+                values = np.load(os.path.join(yeardir, name + ".npy"), mmap_mode="r")
+                parts[name].append(values[period])
+            for name in masks:
+                packed = np.load(os.path.join(yeardir, name + "_mask.npy"), mmap_mode="r")
+                masks[name].append(np.unpackbits(packed, count=meta["size"]).view(bool)[period])
+
+        if not(years):
+            return collection
+        if len(years) == 1:
+            merged = {name: values[0] for name, values in parts.items()}
+            masks = {name: values[0] for name, values in masks.items()}
+        else:
+            merged = {name: np.concatenate(values) for name, values in parts.items()}
+            masks = {name: np.concatenate(values) for name, values in masks.items()}
+        collection.time = merged["time"]
+        collection.temperatureQF = merged["temperatureQF"]
+        collection.salinityQF = merged["salinityQF"]
+        collection.temperature = np.ma.masked_array(merged["temperature"], mask=masks["temperature"])
+        collection.salinity = np.ma.masked_array(merged["salinity"], mask=masks["salinity"])
+        collection.build_index()
+        return collection
+
+    def build_index(self):
+        """
+        Compute the slice of the arrays corresponding to each (year, month)
+        """
+        months = self.time.astype("datetime64[s]").astype("datetime64[M]")
+        monthlist, starts = np.unique(months, return_index=True)
+        stops = np.append(starts[1:], len(months))
+        self.index = {}
+        for mm, start, stop in zip(monthlist.astype(object), starts, stops):
+            self.index[(mm.year, mm.month)] = slice(int(start), int(stop))
+
+    def select(self, year, month=None):
+        """
+        Return a Mooring with the measurements of the given year (and month),
+        of which the arrays are views on those of the collection
+        """
+        slices = [self.index[key] for key in sorted(self.index)
+                  if key[0] == year and (month is None or key[1] == month)]
+        m = Mooring()
+        m.longitude, m.latitude = self.longitude, self.latitude
+        if not(slices):
+            return m
+        period = slice(slices[0].start, slices[-1].stop)
+        m.temperature = self.temperature[period]
+        m.salinity = self.salinity[period]
+        m.temperatureQF = self.temperatureQF[period]
+        m.salinityQF = self.salinityQF[period]
+        m.time = self.time[period]
+        return m
+
+
+class Climatology(object):
+    """
+    Day-of-year (or hour-of-year) climatology of the mooring variables,
+    accumulated as count, sum and sum of squares so that new measurements
+    can be added without reading the previous years again.
+
+    For each source (e.g. a file or a station), only the measurements
+    more recent than the last ones already added are taken into account.
+    """
+
+    def __init__(self, resolution="day", variables=("temperature", "salinity")):
+        if resolution == "day":
+            self.nbins = 366
+        elif resolution == "hour":
+            self.nbins = 366 * 24
+        else:
+            raise ValueError('Unknown resolution: {0}'.format(resolution))
+        self.resolution = resolution
+        self.variables = list(variables)
+        self.count = {name: np.zeros(self.nbins, dtype=np.int64) for name in self.variables}
+        self.sum = {name: np.zeros(self.nbins) for name in self.variables}
+        self.sumsq = {name: np.zeros(self.nbins) for name in self.variables}
+        self.lasttime = {}
+
+    def get_bins(self, time):
+        """
+        Return the bin (day or hour since the 1st of January) of each time,
+        counted in a leap year so that a given date always falls in the
+        same bin (the 29th of February only receives the leap years)
+        """
+        time = np.asarray(time).astype("datetime64[s]")
+        month = time.astype("datetime64[M]")
+        monthofyear = (month - month.astype("datetime64[Y]")).astype(np.int64)
+        monthstart = (np.datetime64("2000-01", "M") + monthofyear).astype("datetime64[s]")
+        elapsed = ((monthstart - np.datetime64("2000-01-01T00:00:00"))
+                   + (time - month)).astype(np.int64)
+        if self.resolution == "day":
+            return elapsed // 86400
+        return elapsed // 3600
+
+    def update(self, mooring, source=None):
+        """
+        Add the measurements of a (quality-controlled) Mooring,
+        skipping those already added for the same `source`
+        (by default the name of the file)
+        """
+        if source is None:
+            source = getattr(mooring, "filename", None)
+        if source is None:
+            raise ValueError('No source given for the measurements')
+        # Same key as after a round trip through the JSON of `save`
+        source = str(source)
+        start = 0
+        if source in self.lasttime:
+            start = np.searchsorted(mooring.time, self.lasttime[source], side="right")
+        if start >= len(mooring.time):
+            return 0
+        bins = self.get_bins(mooring.time[start:])
+        for name in self.variables:
+            field = getattr(mooring, name)[start:]
+            values = np.ma.getdata(field).astype(np.float64)
+            valid = ~np.ma.getmaskarray(field) & np.isfinite(values)
+            self.count[name] += np.bincount(bins[valid], minlength=self.nbins)
+            self.sum[name] += np.bincount(bins[valid], weights=values[valid], minlength=self.nbins)
+            self.sumsq[name] += np.bincount(bins[valid], weights=values[valid] ** 2, minlength=self.nbins)
+        self.lasttime[source] = int(mooring.time[-1])
+        return len(mooring.time) - start
+
+    def get_mean(self, name):
+        """
+        Return the climatological mean of the variable (NaN for empty bins)
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sum[name] / self.count[name]
+
+    def get_std(self, name):
+        """
+        Return the climatological standard deviation of the variable
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sum[name] / self.count[name]
+            variance = self.sumsq[name] / self.count[name] - mean ** 2
+        return np.sqrt(np.maximum(variance, 0.))
+
+    def get_anomaly(self, mooring, name="temperature", standardized=False):
+        """
+        Return the anomaly of the variable with respect to the climatology,
+        as a masked array on the time axis of the Mooring, optionally
+        divided by the climatological standard deviation
+        """
+        bins = self.get_bins(mooring.time)
+        field = getattr(mooring, name)
+        anomaly = field - self.get_mean(name)[bins]
+        if standardized:
+            anomaly = anomaly / self.get_std(name)[bins]
+        return np.ma.masked_invalid(anomaly)
+
+    def save(self, filename):
+        """
+        Write the accumulators to a .npz file
+        """
+        arrays = {"resolution": np.array(self.resolution),
+                  "lasttime": np.array(json.dumps(self.lasttime))}
+        for name in self.variables:
+            arrays[name + "_count"] = self.count[name]
+            arrays[name + "_sum"] = self.sum[name]
+            arrays[name + "_sumsq"] = self.sumsq[name]
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read the accumulators written by `save`
+        """
+        with np.load(filename) as data:
+            variables = [key[:-len("_count")] for key in data.files if key.endswith("_count")]
+            climatology = cls(str(data["resolution"]), variables)
+            for name in variables:
+                climatology.count[name] = data[name + "_count"]
+                climatology.sum[name] = data[name + "_sum"]
+                climatology.sumsq[name] = data[name + "_sumsq"]
+            climatology.lasttime = json.loads(str(data["lasttime"]))
+        return climatology
+
+
+class QCTest(object):
+    """
+    Base class of the tests run by a QCPipeline.
+
+    `apply` receives the values, quality flags and time of a chunk of
+    measurements and returns a boolean array, True for the rejected values.
+    `before` and `after` are the numbers of neighbouring measurements
+    the test needs on each side of the chunk.
+    """
+
+    name = "test"
+    before = 0
+    after = 0
+
+    def apply(self, values, qf, time):
+        raise NotImplementedError
+
+
+class FlagTest(QCTest):
+    """
+    Reject the measurements of which the quality flag is not in `good`
+    """
+
+    name = "flag"
+
+    def __init__(self, good=1):
+        self.good = np.atleast_1d(good)
+
+    def apply(self, values, qf, time):
+        return ~np.isin(qf, self.good)
+
+
+class BlackoutTest(QCTest):
+    """
+    Reject the measurements taken during the list of (start, end) `windows`
+    """
+
+    name = "blackout"
+
+    def __init__(self, windows):
+        self.windows = [(as_epoch(start), as_epoch(end)) for start, end in windows]
+
+    def apply(self, values, qf, time):
+        rejected = np.zeros(len(time), dtype=bool)
+        for start, end in self.windows:
+            rejected |= (time >= start) & (time <= end)
+        return rejected
+
+
+class RangeTest(QCTest):
+    """
+    Reject the values outside the interval [`vmin`, `vmax`]
+    """
+
+    name = "range"
+
+    def __init__(self, vmin, vmax):
+        self.vmin = vmin
+        self.vmax = vmax
+
+    def apply(self, values, qf, time):
+        return (values < self.vmin) | (values > self.vmax)
+
+
+class SpikeTest(QCTest):
+    """
+    Reject the values departing from their two neighbours by more than
+    `threshold`, once the difference between the neighbours is removed
+    """
+
+    name = "spike"
+    before = 1
+    after = 1
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+
+    def apply(self, values, qf, time):
+        rejected = np.zeros(len(values), dtype=bool)
+        previous, current, following = values[:-2], values[1:-1], values[2:]
+        rejected[1:-1] = (np.abs(current - 0.5 * (previous + following))
+                          - 0.5 * np.abs(following - previous)) > self.threshold
+        return rejected
+
+
+class GradientTest(QCTest):
+    """
+    Reject the values departing from the mean of their two neighbours
+    by more than `threshold`
+    """
+
+    name = "gradient"
+    before = 1
+    after = 1
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+
+    def apply(self, values, qf, time):
+        rejected = np.zeros(len(values), dtype=bool)
+        rejected[1:-1] = np.abs(values[1:-1] - 0.5 * (values[:-2] + values[2:])) > self.threshold
+        return rejected
+
+
+class StuckValueTest(QCTest):
+    """
+    Reject the values repeated at least `nvalues` times in a row
+    """
+
+    name = "stuck"
+
+    def __init__(self, nvalues):
+        self.nvalues = nvalues
+        self.before = nvalues - 1
+        self.after = nvalues - 1
+
+    def apply(self, values, qf, time):
+        if len(values) == 0:
+            return np.zeros(0, dtype=bool)
+        newrun = np.ones(len(values), dtype=bool)
+        newrun[1:] = values[1:] != values[:-1]
+        run = np.cumsum(newrun) - 1
+        return np.bincount(run)[run] >= self.nvalues
+
+
+class QCPipeline(object):
+    """
+    Sequence of quality control tests applied to the variables of a Mooring.
+
+    The measurements are processed by chunks of `chunksize` values, so
+    that the variables of a Mooring opened in lazy mode are never read
+    at once. For each variable, a single boolean mask is updated in place
+    by all the tests and stored in `qcmask`, while `qcflags` stores the
+    number of the first test rejecting each measurement: the name of the
+    test is `qctests[flag - 1]` (the flag is 0 if the measurement passed
+    all the tests or was already missing).
+    """
+
+    def __init__(self, tests, chunksize=100000):
+        self.tests = list(tests)
+        self.chunksize = chunksize
+
+    @timed("qc")
+    def run(self, mooring, variables=("temperature", "salinity")):
+        """
+        Run the tests on the variables of the Mooring
+        """
+        logger = logging.getLogger("timeseries_logger")
+        ntime = len(mooring.time)
+        # Each test can depend on the values rejected by the previous ones
+        before = sum(test.before for test in self.tests)
+        after = sum(test.after for test in self.tests)
+        for name in variables:
+            mask = mooring.qcmask.get(name)
+            if mask is None:
+                mask = np.zeros(ntime, dtype=bool)
+            flags = mooring.qcflags.get(name)
+            if flags is None:
+                flags = np.zeros(ntime, dtype=np.uint8)
+            testnames = mooring.qctests.setdefault(name, [])
+            offset = len(testnames)
+            if offset + len(self.tests) > 255:
+                raise ValueError('Too many tests for {0}'.format(name))
+            testnames.extend([test.name for test in self.tests])
+            # Values rejected before this run: the values rejected in the
+            # margins by the tests of this run are found again with each chunk
+            rejectedbefore = mask.copy()
+            for start in range(0, ntime, self.chunksize):
+                stop = min(start + self.chunksize, ntime)
+                first, last = max(start - before, 0), min(stop + after, ntime)
+                chunk = mooring.get_chunk(name, first, last)
+                qf = np.ma.getdata(mooring.get_chunk(name + "QF", first, last))
+                # The missing and rejected values are never compared with their neighbours
+                values = np.ma.filled(chunk.astype(np.float64), np.nan)
+                values[rejectedbefore[first:last]] = np.nan
+                inner = slice(start - first, stop - first)
+                chunkmask = mask[start:stop]
+                chunkflags = flags[start:stop]
+                chunkmask |= np.ma.getmaskarray(chunk)[inner]
+                for ii, test in enumerate(self.tests):
+                    rejected = test.apply(values, qf, mooring.time[first:last])
+                    values[rejected] = np.nan
+                    rejected = rejected[inner]
+                    chunkflags[rejected & ~chunkmask] = offset + ii + 1
+                    chunkmask |= rejected
+            logger.debug('{0}: {1} values rejected'.format(name, mask.sum()))
+
+            mooring.qcmask[name] = mask
+            mooring.qcflags[name] = flags
+            if name in mooring._data:
+                mooring._data[name] = np.ma.masked_array(np.ma.getdata(mooring._data[name]),
+                                                         mask=mask, copy=False)
+
+
+class MooringCache(object):
+    """
+    Local copy of the variables read from remote netCDF files
+
+    Each file is stored as a compressed .npz archive named after the hash of
+    its URL, while an index keeps track of the size, the fetch time and the
+    last access time of the entries.
+    The files of which the last month was over when they were fetched never
+    expire, the other ones are fetched again when older than `maxage` seconds.
+    The least recently used entries are removed when the total size
+    exceeds `maxsize` bytes.
+    """
+
+    def __init__(self, cachedir, maxsize=500e6, maxage=3600.):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        self.maxage = maxage
+        self.indexfile = os.path.join(cachedir, "index.json")
+        if not(os.path.exists(cachedir)):
+            os.makedirs(cachedir)
+        if os.path.exists(self.indexfile):
+            with open(self.indexfile) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+    def _path(self, url):
+        return os.path.join(self.cachedir,
+                            hashlib.sha1(url.encode("utf-8")).hexdigest() + ".npz")
+
+    def _save_index(self):
+        with open(self.indexfile + ".tmp", "w") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(self.indexfile + ".tmp", self.indexfile)
+
+    def get(self, url):
+        """
+        Return the dictionary of variables stored for `url`,
+        or None if the entry is missing or expired
+        """
+        entry = self.index.get(url)
+        if entry is None:
+            return None
+        if not(entry["closed"]) and (time.time() - entry["fetched"] > self.maxage):
+            logger = logging.getLogger("timeseries_logger")
+            logger.debug('Cache entry for {0} has expired'.format(url))
+            self.remove(url)
+            return None
+        try:
+            with np.load(self._path(url)) as data:
+                variables = {}
+                for name in ["temperature", "salinity"]:
+                    variables[name] = np.ma.masked_array(data[name], mask=data[name + "_mask"])
+                for name in ["temperatureQF", "salinityQF", "time"]:
+                    variables[name] = data[name]
+                variables["timeunits"] = str(data["timeunits"])
+                for name in ["longitude", "latitude"]:
+                    variables[name] = float(data[name]) if name in data.files else np.nan
+        except (OSError, KeyError):
+            self.remove(url)
+            return None
+
+        entry["accessed"] = time.time()
+        self._save_index()
+        return variables
+
+    def put(self, url, variables):
+        """
+        Store the dictionary of variables read from `url`
+        """
+        if len(variables["time"]) == 0:
+            return
+        arrays = {"timeunits": np.array(variables["timeunits"]),
+                  "longitude": np.array(variables.get("longitude", np.nan)),
+                  "latitude": np.array(variables.get("latitude", np.nan))}
+        for name in ["temperature", "salinity"]:
+            arrays[name] = np.ma.getdata(variables[name])
+            arrays[name + "_mask"] = np.ma.getmaskarray(variables[name])
+        for name in ["temperatureQF", "salinityQF", "time"]:
+            arrays[name] = np.ma.getdata(variables[name])
+        fname = self._path(url)
+        np.savez_compressed(fname, **arrays)
+
+        # The file is complete if its last month is over
+        lastdate = time.gmtime(num2epoch(variables["time"], variables["timeunits"]).max())
+        now = time.time()
+        today = time.gmtime(now)
+        self.index[url] = {"size": os.path.getsize(fname),
+                           "fetched": now,
+                           "accessed": now,
+                           "closed": (today.tm_year, today.tm_mon) > (lastdate.tm_year, lastdate.tm_mon)}
+        self._evict()
+        self._save_index()
+
+    def remove(self, url):
+        """
+        Remove the entry corresponding to `url`
+        """
+        if url in self.index:
+            del self.index[url]
+            self._save_index()
+        if os.path.exists(self._path(url)):
+            os.remove(self._path(url))
+
+    def __contains__(self, url):
+        """
+        Check if a valid entry exists for `url`, without reading it
+        """
+        entry = self.index.get(url)
+        if entry is None:
+            return False
+        return entry["closed"] or (time.time() - entry["fetched"] <= self.maxage)
+
+    def _evict(self):
+        """
+        Remove the least recently used entries until the cache fits in `maxsize`
+        """
+        totalsize = sum(entry["size"] for entry in self.index.values())
+        for url in sorted(self.index, key=lambda u: self.index[u]["accessed"]):
+            if totalsize <= self.maxsize:
+                break
+            totalsize -= self.index[url]["size"]
+            del self.index[url]
+            if os.path.exists(self._path(url)):
+                os.remove(self._path(url))
+
+
+def _read_file(cls, filename):
+    """
+    Read a single file in one of the workers of `Mooring.from_files`
+    """
+    return cls().get_from_nc(filename, strict=True)
+
+
+figtitles = {"temperature": 'Sea water temperature ($^{\\circ}$C)\n at %s buoy',
+             "salinity": 'Sea water salinity\n at %s buoy'}
+figprefixes = {"temperature": "temp", "salinity": "psal"}
+
+
+def _prepare_station(blackout, *moorings):
+    """
+    Merge the files of a station and apply the quality control
+    """
+    collection = MooringCollection.from_moorings([m for m in moorings if m is not None])
+    collection.apply_qc()
+    if blackout:
+        windows = [[datetime.datetime.strptime(date, "%Y-%m-%dT%H:%M:%S") for date in window]
+                   for window in blackout]
+        collection.special_qc(windows)
+    return collection
+
+
+def _summarise_station(statsfile, collection):
+    """
+    Write the yearly statistics of a station to a JSON file
+    """
+    statistics = collection.get_statistics(by="year")
+    summary = {"years": statistics["keys"].tolist()}
+    for name in ["temperature", "salinity"]:
+        summary[name] = {key: (values.astype(str) if key.startswith("date") else values).tolist()
+                         for key, values in statistics[name].items()}
+    with open(statsfile, "w") as f:
+        json.dump(summary, f, indent=1)
+    return statsfile
+
+
+def _month_range(station):
+    """
+    Return the first and last months of the year plotted for a station
+    """
+    months = station.get("months")
+    if not(months):
+        return 1, 12
+    return min(months), max(months)
+
+
+def _plot_station(job, options, collection):
+    """
+    Render the figure of a station, for all the years available
+    """
+    import render
+    years = sorted(set(year for year, month in collection.index))
+    return render._render_job(collection, job._replace(years=years), options)
+
+
+def run(config):
+    """
+    Read, check, summarise and plot the data of all the stations of the
+    configuration, as a graph of tasks: each file is read once in the pool
+    of processes, then the products of all the stations are computed
+    as soon as their data are available.
+    """
+    import render
+    import catalog
+    import tasks
+    logger = logging.getLogger("timeseries_logger")
     timenow = datetime.datetime.now().strftime('%Y%m%d_%H%M')
 
-    figdir = "../plots"
+    figdir = config.get("figdir", "../plots")
     if not(os.path.exists(figdir)):
         os.makedirs(figdir)
         logger.debug("Creating figure directory: {}".format(figdir))
-    # figdir2 = "/home/ctroupin/public_html/TemperatureTimeSeries"
-
-    figname1T = "temp_bahiadepalma_" + timenow + '.png'
-    figname1Tlatest = "temp_bahiadepalma_latest.png"
-    figname2T = "temp_canaldeibiza_" + timenow + '.png'
-    figname2Tlatest = "temp_canaldeibiza_latest.png"
-    figname1S = "psal_bahiadepalma_" + timenow + '.png'
-    figname1Slatest = "psal_bahiadepalma_latest.png"
-    figname2S = "psal_canaldeibiza_" + timenow + '.png'
-    figname2Slatest = "psal_canaldeibiza_latest.png"
-
-    """
-    Generate the file list
-    probably a more clever way to do it, but there are several deployments
-    for each of the platform and so the names have changed.
-    Using new API would be better
-    """
-
-    file_basename = "http://thredds.socib.es/thredds/dodsC/mooring/conductivity_and_temperature_recorder/"
-    file_list = ['buoy_bahiadepalma-scb_sbe37005/L1/2014/dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2014-06.nc',
-                 'buoy_bahiadepalma-scb_sbe37005/L1/2014/dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2014-07.nc',
-                 'buoy_bahiadepalma-scb_sbe37005/L1/2014/dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2014-08.nc',
-                 'buoy_bahiadepalma-scb_sbe37005/L1/2015/dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2015-06.nc',
-                 'buoy_bahiadepalma-scb_sbe37005/L1/2015/dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2015-07.nc',
-                 'buoy_bahiadepalma-scb_sbe37005/L1/2015/dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2015-08.nc',
-                 'buoy_bahiadepalma-scb_sbe37007/L1/2016/dep0001_buoy-bahiadepalma_scb-sbe37007_L1_2016-06.nc',
-                 'buoy_bahiadepalma-scb_sbe37007/L1/2016/dep0001_buoy-bahiadepalma_scb-sbe37007_L1_2016-07.nc',
-		         'buoy_bahiadepalma-scb_sbe37007/L1/2016/dep0001_buoy-bahiadepalma_scb-sbe37007_L1_2016-08.nc',
-                 'buoy_bahiadepalma-scb_sbe37007/L1/2017/dep0001_buoy-bahiadepalma_scb-sbe37007_L1_2017-06.nc',
-                 'buoy_bahiadepalma-scb_sbe37007/L1/2017/dep0001_buoy-bahiadepalma_scb-sbe37007_L1_2017-07.nc',
-                 'buoy_bahiadepalma-scb_sbe37007/L1/2017/dep0001_buoy-bahiadepalma_scb-sbe37007_L1_2017-08.nc',
-                 'buoy_bahiadepalma-scb_sbe37006/L1/2018/dep0004_buoy-bahiadepalma_scb-sbe37006_L1_2018-06.nc',
-                 'buoy_bahiadepalma-scb_sbe37006/L1/2018/dep0004_buoy-bahiadepalma_scb-sbe37006_L1_2018-07.nc',
-                 'buoy_bahiadepalma-scb_sbe37006/L1/2018/dep0004_buoy-bahiadepalma_scb-sbe37006_L1_2018-08.nc']
-    file_list = [file_basename + s for s in file_list]
-
-
-    file_list2 = ["buoy_canaldeibiza-scb_sbe37005/L1/2016/dep0003_buoy-canaldeibiza_scb-sbe37005_L1_2016-07.nc",
-                  "buoy_canaldeibiza-scb_sbe37005/L1/2016/dep0003_buoy-canaldeibiza_scb-sbe37005_L1_2016-08.nc",
-                  "buoy_canaldeibiza-scb_sbe37005/L1/2017/dep0004_buoy-canaldeibiza_scb-sbe37005_L1_2017-06.nc",
-                  "buoy_canaldeibiza-scb_sbe37005/L1/2017/dep0004_buoy-canaldeibiza_scb-sbe37005_L1_2017-07.nc",
-                  "buoy_canaldeibiza-scb_sbe37005/L1/2017/dep0004_buoy-canaldeibiza_scb-sbe37005_L1_2017-08.nc"
-                  ]
-
-    file_list2 = [file_basename + s for s in file_list2]
-
-    colorlist = ["#FDB117", "#20BD00", "#6C5FBA", "#0FB5C4", "k"]
-    # Bahia de Palma
-    mooring = "Bahia de Palma"
-    logger.info('Working on %s data' %(mooring))
-    figtitleT = 'Sea water temperature ($^{\circ}$C)\n at %s buoy' %(mooring)
-    figtitleS = 'Sea water salinity\n at %s buoy' %(mooring)
-    logger.debug('Reading the files')
-    buoytemperature, buoysalinity, buoytime, buoydate, buoyyear = read_time_temp_mooring(file_list)
-    buoydate = np.array([dd.replace(year=int(buoyyear.min())) for dd in buoydate])
-    logger.debug('Creating the plots')
-    logger.debug('Temperature')
-    plot_mooring_timeseries(buoyyear, buoydate, buoytemperature, figtitleT, os.path.join(figdir, figname1T), colorlist)
-    logger.debug('Salinity')
-    plot_mooring_timeseries(buoyyear, buoydate, buoysalinity, figtitleS, os.path.join(figdir, figname1S), colorlist)
-
-    # Canal de Ibiza
-    """
-    mooring = "Canal de Ibiza"
-    logger.info('Working on %s data' %(mooring))
-    figtitleT = 'Sea water temperature ($^{\circ}$C)\n at %s buoy' %(mooring)
-    figtitleS = 'Sea water salinity\n at %s buoy' %(mooring)
-    logger.debug('Reading the files')
-    buoytemperature, buoysalinity, buoytime, buoydate, buoyyear = read_time_temp_mooring(file_list2)
-    buoydate = np.array([dd.replace(year=int(buoyyear.min())) for dd in buoydate])
-    logger.debug('Creating the plots')
-    logger.debug('Temperature')
-    plot_mooring_timeseries(buoyyear, buoydate, buoytemperature, figtitleT, os.path.join(figdir, figname2T))
-    logger.debug('Salinity')
-    plot_mooring_timeseries(buoyyear, buoydate, buoysalinity, figtitleS, os.path.join(figdir, figname2S))
-    """
+    cache = None
+    if config.get("cachedir"):
+        cache = MooringCache(config["cachedir"])
+    # Generate the file lists from the catalog (there are several
+    # deployments for each of the platforms, so the names have changed)
+    mooringcatalog = catalog.get_catalog(config["catalog"], indexfile=config.get("indexfile"))
+    options = {"colors": config.get("colors", render.colorlist)}
+
+    graph = tasks.TaskGraph()
+    latest = {}
+    for station in config["stations"]:
+        shortname = station["station"]
+        logger.info('Working on {0} data'.format(station["name"]))
+        file_list = mooringcatalog.files(shortname,
+                                         start=tuple(station["start"]) if station.get("start") else None,
+                                         end=tuple(station["end"]) if station.get("end") else None,
+                                         months=station.get("months"))
+        for filename in file_list:
+            if "read:" + filename in graph:
+                continue
+            if cache is not None and filename in cache:
+                graph.add_result("read:" + filename, Mooring().get_from_nc(filename, cache=cache))
+            else:
+                graph.add("read:" + filename, _read_file, Mooring, filename)
+
+        graph.add("qc:" + shortname, _prepare_station, station.get("blackout"),
+                  deps=["read:" + filename for filename in file_list], pool="thread", allow_failed=True)
+        graph.add("stats:" + shortname, _summarise_station,
+                  os.path.join(figdir, "stats_{0}_{1}.json".format(shortname, timenow)),
+                  deps=["qc:" + shortname], pool="thread")
+        monthmin, monthmax = _month_range(station)
+        for variable in station.get("variables", ["temperature", "salinity"]):
+            figname = "{0}_{1}_{2}.png".format(figprefixes[variable], shortname, timenow)
+            job = render.RenderJob(station["name"], variable, None, os.path.join(figdir, figname),
+                                   figtitles[variable] % (station["name"]), monthmin, monthmax)
+            graph.add("plot:{0}:{1}".format(shortname, variable), _plot_station, job, options,
+                      deps=["qc:" + shortname])
+            latest["plot:{0}:{1}".format(shortname, variable)] = "{0}_{1}_latest.png".format(
+                figprefixes[variable], shortname)
+
+    results, failures = graph.run(workers=config.get("workers", 4), processpool=MetricsProcessPool)
+
+    if cache is not None:
+        for name, result in results.items():
+            if name.startswith("read:") and name[5:] not in cache:
+                cache.put(name[5:], result.get_variables())
 
     # Copy the figures in public html directory
-    # logger.info('Making copies of figures into %s' %figdir2)
-    # shutil.copy2(os.path.join(figdir, figname1T), os.path.join(figdir2, figname1Tlatest))
-    # shutil.copy2(os.path.join(figdir, figname1S), os.path.join(figdir2, figname1Slatest))
-    # shutil.copy2(os.path.join(figdir, figname2T), os.path.join(figdir2, figname2Tlatest))
-    # shutil.copy2(os.path.join(figdir, figname2S), os.path.join(figdir2, figname2Slatest))
+    if config.get("latestdir"):
+        logger.info('Making copies of figures into {0}'.format(config["latestdir"]))
+        for name, latestname in latest.items():
+            if name in results:
+                shutil.copy2(results[name], os.path.join(config["latestdir"], latestname))
+    return results, failures
+
+
+def update(config):
+    """
+    Incremental run: for each file of the stations, only the measurements
+    more recent than those already processed (according to the state file)
+    are read. They are appended to the archive of the station and to its
+    climatology and running maximum, and only the figures of the stations
+    that received new measurements are drawn again, from the archive.
+    The files of which the month was over when they were last read are
+    not opened anymore.
+    """
+    import render
+    import catalog
+    logger = logging.getLogger("timeseries_logger")
+    statefile = config.get("statefile", "mooring_state.json")
+    archivedir = config.get("archivedir", "archive")
+    figdir = config.get("latestdir") or config.get("figdir", "../plots")
+    if not(os.path.exists(figdir)):
+        os.makedirs(figdir)
+    state = {"files": {}, "maximum": {}}
+    if os.path.exists(statefile):
+        with open(statefile) as f:
+            state = json.load(f)
+    mooringcatalog = catalog.get_catalog(config["catalog"], indexfile=config.get("indexfile"))
+    today = time.gmtime()
+
+    data = {}
+    jobs = []
+    for station in config["stations"]:
+        shortname = station["station"]
+        variables = station.get("variables", ["temperature", "salinity"])
+        newdata = []
+        entries = mooringcatalog.query(shortname,
+                                       start=tuple(station["start"]) if station.get("start") else None,
+                                       end=tuple(station["end"]) if station.get("end") else None,
+                                       months=station.get("months"))
+        for entry in entries:
+            filestate = state["files"].get(entry.url, {"lasttime": None, "closed": False})
+            if filestate["closed"]:
+                continue
+            start = None if filestate["lasttime"] is None else filestate["lasttime"] + 1
+            m = Mooring().get_from_nc(entry.url, start=start)
+            if len(m.time):
+                newdata.append(m)
+                filestate["lasttime"] = int(m.time[-1])
+            if filestate["lasttime"] is not None:
+                filestate["closed"] = (today.tm_year, today.tm_mon) > (entry.year, entry.month)
+                state["files"][entry.url] = filestate
+        if not(newdata):
+            logger.info('No new data for {0}'.format(station["name"]))
+            continue
+
+        new = _prepare_station(station.get("blackout"), *newdata)
+        logger.info('{0} new measurements for {1}'.format(len(new.time), station["name"]))
+        new.to_archive(archivedir, shortname, append=True)
+
+        climatologyfile = os.path.join(archivedir, shortname, "climatology.npz")
+        if os.path.exists(climatologyfile):
+            climatology = Climatology.load(climatologyfile)
+        else:
+            climatology = Climatology()
+        climatology.update(new, source=shortname)
+        climatology.save(climatologyfile)
+
+        maximum = state["maximum"].setdefault(shortname, {})
+        statistics = new.get_statistics(percentiles=(), variables=variables)
+        for name in variables:
+            if statistics[name]["count"].sum() and statistics[name]["max"][0] > maximum.get(name, [-np.inf])[0]:
+                maximum[name] = [float(statistics[name]["max"][0]),
+                                 str(statistics[name]["datemax"][0])]
+
+        data[shortname] = MooringCollection.from_archive(archivedir, shortname)
+        years = sorted(set(year for year, month in data[shortname].index))
+        monthmin, monthmax = _month_range(station)
+        for name in variables:
+            figname = "{0}_{1}_latest.png".format(figprefixes[name], shortname)
+            jobs.append(render.RenderJob(shortname, name, years, os.path.join(figdir, figname),
+                                         figtitles[name] % (station["name"]), monthmin, monthmax))
+
+    if jobs:
+        render.render_jobs(jobs, data, workers=config.get("workers", 4),
+                           colors=config.get("colors", render.colorlist))
+    with open(statefile + ".tmp", "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(statefile + ".tmp", statefile)
+    return state
+
+
+def main(configfile="mooring_config.json"):
+
+    with open(configfile) as f:
+        config = json.load(f)
+    logger = configure_logging(timing=config.get("timing", False))
+    logger.info('---Starting new run---')
+    with metrics.stage("run"):
+        if config.get("incremental"):
+            update(config)
+        else:
+            results, failures = run(config)
+            logger.info('{0} tasks done, {1} failed'.format(len(results), len(failures)))
+    metrics.summary()
 
 if __name__ == "__main__":
-    main()
+    # Run from the imported module, so that the worker processes and the
+    # other modules (render, tasks) share its classes and metrics
+    import mooring
+    mooring.main(*sys.argv[1:])
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# coding: utf-8
+
+"""
+Headless rendering of the mooring time series, e.g. from crontab.
+
+The Agg backend is selected when the module is imported. A Renderer keeps
+one figure per layout (number of years overlaid) and only replaces the data
+of the lines from one job to the next, while `render_jobs` distributes the
+independent jobs over a pool of processes.
+"""
+
+import collections
+import concurrent.futures
+import datetime
+import logging
+import numpy as np
+import matplotlib as mpl
+mpl.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib import dates
+import mooring
+
+RenderJob = collections.namedtuple("RenderJob", ["station", "variable", "years",
+                                                 "figname", "title", "monthmin", "monthmax"],
+                                   defaults=(None, None))
+
+colorlist = ["#FDB117", "#20BD00", "#6C5FBA", "#0FB5C4", "k"]
+
+
+class Renderer(object):
+    """
+    Overlay the yearly time series of a variable on a single figure,
+    reusing the figures and lines already created.
+    With `decimate`, only the minimum and maximum per pixel of the saved
+    figure are drawn.
+    """
+
+    def __init__(self, monthmin=6, monthmax=8, colors=colorlist, prop=None,
+                 figsize=(15, 8), dpi=300, decimate=True):
+        self.monthmin = monthmin
+        self.monthmax = monthmax
+        self.colors = colors
+        self.prop = prop
+        self.figsize = figsize
+        self.dpi = dpi
+        self.decimate = decimate
+        self.layouts = {}
+
+    def get_months(self, job):
+        """
+        Return the first and last months plotted for the job
+        (by default those of the Renderer)
+        """
+        return (self.monthmin if job.monthmin is None else job.monthmin,
+                self.monthmax if job.monthmax is None else job.monthmax)
+
+    def get_layout(self, nyears, monthmin=None, monthmax=None):
+        """
+        Return the figure, axes and artists used to plot `nyears` years
+        from `monthmin` to `monthmax`, creating them the first time
+        """
+        monthmin = self.monthmin if monthmin is None else monthmin
+        monthmax = self.monthmax if monthmax is None else monthmax
+        key = (nyears, monthmin, monthmax)
+        if key in self.layouts:
+            return self.layouts[key]
+
+        fig, ax = plt.subplots(num=None, figsize=self.figsize)
+        # The x-axis is always expressed in the year 2000 (leap year)
+        xlim = (np.datetime64(datetime.datetime(2000, monthmin, 1)),
+                np.datetime64(datetime.datetime(2000 + monthmax // 12, monthmax % 12 + 1, 1)))
+        lines = [ax.plot(xlim, [np.nan, np.nan], linewidth=2,
+                         color=self.colors[ii % len(self.colors)])[0]
+                 for ii in range(nyears)]
+        maxpoint, = ax.plot(xlim[:1], [np.nan], "ko")
+        maxtext = ax.text(dates.date2num(xlim[0]), 0., "", ha="left", va="bottom",
+                          fontsize=16, alpha=0.8)
+        maxline, = ax.plot(xlim, [np.nan, np.nan], "k--", linewidth=.3)
+
+        ax.xaxis.set_major_locator(dates.MonthLocator())
+        ax.xaxis.set_minor_locator(dates.DayLocator())
+        ax.xaxis.set_major_formatter(dates.DateFormatter('%B'))
+        ax.spines['right'].set_visible(False)
+        ax.spines['top'].set_visible(False)
+        ax.tick_params(axis='both', which='major', labelsize=16)
+        ax.tick_params(axis='both', which='minor', labelsize=16)
+        if self.prop is not None:
+            for label in ax.get_xticklabels() + ax.get_yticklabels():
+                label.set_fontproperties(self.prop)
+        ax.set_xlim(xlim)
+        ax.grid()
+
+        self.layouts[key] = (fig, ax, lines, maxpoint, maxtext, maxline)
+        return self.layouts[key]
+
+    @mooring.timed("render")
+    def render(self, m, job):
+        """
+        Draw the variable of the Mooring `m` for the years of the job
+        and save the figure
+        """
+        logger = logging.getLogger("timeseries_logger")
+        logger.debug('Rendering {0} at {1}'.format(job.variable, job.station))
+        monthmin, monthmax = self.get_months(job)
+        fig, ax, lines, maxpoint, maxtext, maxline = self.get_layout(len(job.years), monthmin, monthmax)
+
+        # Number of pixels of the axes in the saved figure
+        nbuckets = int(np.ceil(ax.bbox.width * self.dpi / fig.dpi))
+        valmax, datemax = -np.inf, None
+        for line, year in zip(lines, job.years):
+            period = m.window(datetime.datetime(year, monthmin, 1),
+                              datetime.datetime(year + monthmax // 12, monthmax % 12 + 1, 1)
+                              - datetime.timedelta(seconds=1))
+            transfdates, values = period.transf_dates(2000), getattr(period, job.variable)
+            if self.decimate:
+                transfdates, values = mooring.decimate_minmax(transfdates, values, nbuckets)
+            line.set_data(transfdates, values)
+            line.set_label(str(year))
+            statistics = period.get_statistics(percentiles=(), variables=[job.variable])
+            if statistics[job.variable]["count"].sum() and statistics[job.variable]["max"][0] > valmax:
+                valmax = statistics[job.variable]["max"][0]
+                datemax = statistics[job.variable]["datemax"][0].astype(object)
+
+        ax.relim()
+        ax.autoscale_view(scalex=False)
+        ax.set_title(job.title, fontproperties=self.prop, fontsize=20)
+        ax.legend(loc=4, prop=self.prop)
+        if datemax is None:
+            maxpoint.set_visible(False)
+            maxtext.set_visible(False)
+            maxline.set_visible(False)
+        else:
+            xmax = np.datetime64(datemax.replace(year=2000))
+            ymin = ax.get_ylim()[0]
+            maxpoint.set_data([xmax], [valmax])
+            maxtext.set_position((dates.date2num(xmax), valmax))
+            maxtext.set_text("{0}\n({1})".format(np.round(valmax, 2), datemax))
+            maxline.set_data([xmax, xmax], [ymin, valmax])
+            for artist in (maxpoint, maxtext, maxline):
+                artist.set_visible(True)
+        fig.savefig(job.figname, dpi=self.dpi, bbox_inches='tight', pad_inches=0)
+        return job.figname
+
+    def close(self):
+        for layout in self.layouts.values():
+            plt.close(layout[0])
+        self.layouts = {}
+
+
+_renderer = None
+
+
+def _render_job(m, job, options):
+    """
+    Render a job in a worker process, reusing the Renderer of the process
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = Renderer(**options)
+    return _renderer.render(m, job)
+
+
+def render_jobs(jobs, data, workers=4, **options):
+    """
+    Render the list of jobs, where `data` gives the Mooring (or
+    MooringCollection) of each station, using a pool of `workers`
+    processes. The other options are passed to the Renderer.
+
+    Return the list of figures created, and a dictionary with the
+    exception raised by each of the jobs that failed.
+    """
+    logger = logging.getLogger("timeseries_logger")
+    fignames = [None] * len(jobs)
+    failures = {}
+    if workers <= 1:
+        renderer = Renderer(**options)
+        for ii, job in enumerate(jobs):
+            try:
+                fignames[ii] = renderer.render(data[job.station], job)
+            except Exception as err:
+                logger.error('Cannot render {0}: {1}'.format(job.figname, err))
+                failures[job.figname] = err
+        renderer.close()
+        return fignames, failures
+
+    with mooring.MetricsProcessPool(max_workers=workers) as pool:
+        futures = {pool.submit(_render_job, data[job.station], job, options): ii
+                   for ii, job in enumerate(jobs)}
+        for future in concurrent.futures.as_completed(futures):
+            ii = futures[future]
+            try:
+                fignames[ii] = future.result()
+            except Exception as err:
+                logger.error('Cannot render {0}: {1}'.format(jobs[ii].figname, err))
+                failures[jobs[ii].figname] = err
+    return fignames, failures
@@ -0,0 +1,304 @@
+#!/usr/bin/python
+# coding: utf-8
+
+"""
+Module to read the gridded fields (sea surface temperature, wind)
+over the global ocean and extract sub-regions.
+
+The netCDF files are kept open and only the values of the requested time
+and domain are read: the domain is converted into slices of the
+coordinates before reading, taking into account the longitudes crossing
+the limit of the grid (e.g. a domain from -20 to 10 on a grid from 0 to 360
+is read as two blocks). The statistics over the time axis (mean, anomalies)
+are accumulated chunk by chunk, so that a global high-resolution file
+never has to fit in memory.
+"""
+
+import logging
+import datetime
+import numpy as np
+import netCDF4
+import matplotlib.pyplot as plt
+import mooring
+
+
+def lon_slices(lon, lonmin, lonmax):
+    """
+    Return the list of slices of the longitude axis `lon` (regular,
+    covering at most 360 degrees) between `lonmin` and `lonmax`,
+    and the longitudes of the selected points, expressed from `lonmin`
+    """
+    shifted = np.mod(np.asarray(lon, dtype=np.float64) - lonmin, 360.)
+    indices = np.flatnonzero(shifted <= lonmax - lonmin)
+    indices = indices[np.argsort(shifted[indices], kind="stable")]
+    # The axis of the grid is cyclic: at most two contiguous blocks
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    slices = [slice(int(block[0]), int(block[-1]) + 1)
+              for block in np.split(indices, breaks) if len(block)]
+    return slices, lonmin + shifted[indices]
+
+
+def lat_slice(lat, latmin, latmax):
+    """
+    Return the slice of the latitude axis `lat` (increasing or decreasing)
+    between `latmin` and `latmax`
+    """
+    indices = np.flatnonzero((lat >= latmin) & (lat <= latmax))
+    if not(len(indices)):
+        return slice(0, 0)
+    return slice(int(indices[0]), int(indices[-1]) + 1)
+
+
+def _find_variable(nc, standard_names, names):
+    """
+    Return the variable of the netCDF file with one of the standard names,
+    or else with one of the names
+    """
+    for standard_name in standard_names:
+        variables = nc.get_variables_by_attributes(standard_name=standard_name)
+        if variables:
+            return variables[0]
+    for name in names:
+        if name in nc.variables:
+            return nc.variables[name]
+    return None
+
+
+class Field(object):
+    """
+    Gridded field read lazily from a netCDF file
+
+    The variables are given by the dictionaries `standard_names` and
+    `names` (tried in this order), of which the keys are the names of the
+    variables in the object.
+    """
+
+    standard_names = {}
+    names = {}
+
+    def __init__(self):
+        self.nc = None
+        self.filename = None
+        self.lon = np.array([])
+        self.lat = np.array([])
+        self.time = np.array([], dtype=np.int64)
+        self.timeindex = None
+        self.domain = None
+        self.lonregion = np.array([])
+        self.latregion = np.array([])
+
+    def readfile(self, filename):
+        """
+        Open the netCDF file and read the coordinates
+        (the variables are only read when a region is extracted)
+        """
+        logger = logging.getLogger("timeseries_logger")
+        logger.info('Working on {0}'.format(filename))
+        self.close()
+        self.filename = filename
+        self.nc = netCDF4.Dataset(filename)
+        lonvar = _find_variable(self.nc, ["longitude"], ["lon", "longitude"])
+        latvar = _find_variable(self.nc, ["latitude"], ["lat", "latitude"])
+        if lonvar is None or latvar is None:
+            raise ValueError('No coordinates in {0}'.format(filename))
+        self.lon = np.ma.getdata(lonvar[:])
+        self.lat = np.ma.getdata(latvar[:])
+        self.londim = lonvar.dimensions[0]
+        self.latdim = latvar.dimensions[0]
+
+        timevar = _find_variable(self.nc, ["time"], ["time"])
+        if timevar is None:
+            self.time = np.array([], dtype=np.int64)
+            self.timedim = None
+        else:
+            self.time = mooring.num2epoch(timevar[:], timevar.units)
+            self.timedim = timevar.dimensions[0]
+        self.timeindex = 0 if len(self.time) else None
+
+        self.variables = {}
+        for key in self.names:
+            var = _find_variable(self.nc, self.standard_names.get(key, []), self.names[key])
+            if var is None:
+                raise ValueError('No variable {0} in {1}'.format(key, filename))
+            self.variables[key] = var
+        return self
+
+    def close(self):
+        if self.nc is not None:
+            self.nc.close()
+            self.nc = None
+
+    def extractime(self, year, month=1, day=1, hour=0):
+        """
+        Select the time step of the file closest to the given date
+        """
+        if not(len(self.time)):
+            raise ValueError('No time in {0}'.format(self.filename))
+        date = mooring.as_epoch(datetime.datetime(year, month, day, hour))
+        self.timeindex = int(np.argmin(np.abs(self.time - date)))
+        logger = logging.getLogger("timeseries_logger")
+        logger.debug('Selecting time {0}'.format(mooring.epoch2date(self.time[self.timeindex])))
+        return self.timeindex
+
+    def get_slices(self, domain=None):
+        """
+        Return the slices of longitude and the slice of latitude of the
+        domain (lonmin, lonmax, latmin, latmax), and the coordinates of
+        the region (latitudes increasing)
+        """
+        if domain is None:
+            return [slice(None)], slice(None), self.lon, np.sort(self.lat)
+        lonmin, lonmax, latmin, latmax = domain
+        lonslices, lonregion = lon_slices(self.lon, lonmin, lonmax)
+        latslice = lat_slice(self.lat, latmin, latmax)
+        return lonslices, latslice, lonregion, np.sort(self.lat[latslice])
+
+    def read_variable(self, name, period, lonindex, latindex):
+        """
+        Read the variable `name` for the time index (or slice) `period` and
+        the indices of longitude and latitude (slices or increasing arrays)
+
+        Return a masked array (time, lat, lon), or (lat, lon) if `period` is
+        an integer or the file has no time, in the order of the file
+        """
+        var = self.variables[name]
+        index = []
+        for dim in var.dimensions:
+            if dim == self.londim:
+                index.append(lonindex)
+            elif dim == self.latdim:
+                index.append(latindex)
+            elif dim == self.timedim:
+                index.append(period if period is not None else self.timeindex)
+            else:
+                index.append(0)
+        values = np.ma.asarray(var[tuple(index)])
+        # Order of the dimensions of the values read
+        dims = [dim for dim, ii in zip(var.dimensions, index) if not(np.isscalar(ii))]
+        order = [dims.index(dim) for dim in (self.timedim, self.latdim, self.londim) if dim in dims]
+        return values.transpose(order)
+
+    def read_block(self, name, period=None, domain=None, step=1):
+        """
+        Read the variable `name` for the time index (or slice) `period`
+        within the domain, taking one point out of `step` in each direction.
+
+        Return a masked array (time, lat, lon), or (lat, lon) if `period` is
+        an integer or the file has no time, with the latitudes increasing
+        """
+        lonslices, latslice, _, _ = self.get_slices(domain)
+        if step > 1:
+            lonslices = [slice(s.start, s.stop, step) for s in lonslices]
+            latslice = slice(latslice.start, latslice.stop, step)
+        blocks = [self.read_variable(name, period, lonslice, latslice) for lonslice in lonslices]
+        values = np.ma.concatenate(blocks, axis=-1)
+        if len(self.lat) > 1 and self.lat[0] > self.lat[-1]:
+            values = values[..., ::-1, :]
+        return values
+
+    def iter_blocks(self, name, domain=None, chunksize=10):
+        """
+        Yield the slices of time steps and the corresponding values
+        (time, lat, lon) of the variable within the domain,
+        reading `chunksize` time steps at once
+        """
+        for start in range(0, len(self.time), chunksize):
+            period = slice(start, min(start + chunksize, len(self.time)))
+            yield period, self.read_block(name, period, domain)
+
+    def get_mean(self, name, domain=None, chunksize=10):
+        """
+        Return the mean over the time steps of the file of the variable
+        within the domain (masked where no valid value),
+        or its values if the file has no time
+        """
+        if not(len(self.time)):
+            return self.read_block(name, None, domain)
+        total, count = None, None
+        for period, values in self.iter_blocks(name, domain, chunksize):
+            valid = ~np.ma.getmaskarray(values)
+            data = np.where(valid, np.ma.getdata(values), 0.)
+            if total is None:
+                total = np.zeros(values.shape[1:])
+                count = np.zeros(values.shape[1:], dtype=np.int64)
+            total += data.sum(axis=0)
+            count += valid.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.ma.masked_invalid(total / count)
+
+    def get_anomaly(self, name, domain=None, mean=None, chunksize=10):
+        """
+        Return the anomaly of the variable at the selected time
+        with respect to its mean over the time steps of the file
+        (or to `mean`, e.g. a climatology read from another file)
+        """
+        if mean is None:
+            mean = self.get_mean(name, domain, chunksize)
+        return self.read_block(name, self.timeindex, domain) - mean
+
+
+class sstfield(Field):
+    """
+    Sea surface temperature field, e.g. from the OceanColor L3 files
+    """
+
+    standard_names = {"sst": ["sea_surface_temperature", "sea_surface_skin_temperature"]}
+    names = {"sst": ["sst", "analysed_sst", "SST"]}
+
+    def extractdomain(self, domain):
+        """
+        Read the temperature within the domain (lonmin, lonmax, latmin, latmax)
+        at the selected time
+        """
+        self.domain = domain
+        _, _, self.lonregion, self.latregion = self.get_slices(domain)
+        self.sstregion = self.read_block("sst", self.timeindex, domain)
+
+
+class windfield(Field):
+    """
+    Wind field (e.g. ECMWF 10-m wind)
+    """
+
+    standard_names = {"u": ["eastward_wind"], "v": ["northward_wind"]}
+    names = {"u": ["u10", "u", "uwnd"], "v": ["v10", "v", "vwnd"]}
+
+    def read_variable(self, name, period, lonindex, latindex):
+        """
+        Read the components of the wind or the speed ("speed"),
+        computed from the components of each block read
+        """
+        if name == "speed":
+            u = Field.read_variable(self, "u", period, lonindex, latindex)
+            v = Field.read_variable(self, "v", period, lonindex, latindex)
+            return np.ma.sqrt(u ** 2 + v ** 2)
+        return Field.read_variable(self, name, period, lonindex, latindex)
+
+    def extractdomain(self, domain):
+        """
+        Read the wind within the domain (lonmin, lonmax, latmin, latmax)
+        at the selected time
+        """
+        self.domain = domain
+        _, _, self.lonregion, self.latregion = self.get_slices(domain)
+        self.uregion = self.read_block("u", self.timeindex, domain)
+        self.vregion = self.read_block("v", self.timeindex, domain)
+        self.speedregion = np.ma.sqrt(self.uregion ** 2 + self.vregion ** 2)
+
+    def plot_global(self, m, scale=600, npoints=100):
+        """
+        Plot the wind vectors (coloured by the speed) at the selected time
+        on the Basemap projection `m`, with about `npoints` arrows
+        along each direction
+        """
+        step = max(1, len(self.lon) // npoints)
+        u = self.read_block("u", self.timeindex, step=step)
+        v = self.read_block("v", self.timeindex, step=step)
+        lon = np.mod(self.lon[::step] + 180., 360.) - 180.
+        lat = np.sort(self.lat[::step])
+        llon, llat = np.meshgrid(lon, lat)
+        x, y = m(llon, llat)
+        qv = m.quiver(x, y, u, v, np.ma.sqrt(u ** 2 + v ** 2), scale=scale)
+        m.drawcoastlines(linewidth=.5)
+        plt.colorbar(qv, shrink=.7)
+        return qv
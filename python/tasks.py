@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# coding: utf-8
+
+"""
+Minimal dependency graph of tasks executed on pools of workers.
+
+Each task is submitted as soon as all the tasks it depends on are done,
+and receives their results as its last arguments. The tasks are run either
+in a pool of processes (reading files, rendering figures) or in a pool of
+threads (light tasks working on the results of other tasks).
+"""
+
+import collections
+import concurrent.futures
+import logging
+
+Task = collections.namedtuple("Task", ["func", "args", "deps", "pool", "allow_failed"])
+
+
+class DependencyError(Exception):
+    """
+    Raised for the tasks not run because one of their dependencies failed
+    """
+    pass
+
+
+class TaskGraph(object):
+    """
+    Set of tasks and of their dependencies
+    """
+
+    def __init__(self):
+        self.tasks = collections.OrderedDict()
+        self.results = {}
+
+    def __contains__(self, name):
+        return name in self.tasks or name in self.results
+
+    def add(self, name, func, *args, deps=(), pool="process", allow_failed=False):
+        """
+        Add the task `name`, calling `func(*args, *results of deps)`.
+        If `allow_failed` is True, the task is run even if some of its
+        dependencies failed, with None as their result.
+        """
+        if name in self:
+            raise ValueError('Task {0} already defined'.format(name))
+        self.tasks[name] = Task(func, args, list(deps), pool, allow_failed)
+
+    def add_result(self, name, result):
+        """
+        Add a task of which the result is already known
+        """
+        if name in self:
+            raise ValueError('Task {0} already defined'.format(name))
+        self.results[name] = result
+
+    def run(self, workers=4, processpool=concurrent.futures.ProcessPoolExecutor):
+        """
+        Run all the tasks, using at most `workers` processes and `workers` threads
+        (the pool of processes is an instance of `processpool`)
+
+        Return the dictionary of the results and the dictionary of the
+        exceptions raised by the tasks that failed
+        """
+        logger = logging.getLogger("timeseries_logger")
+        results = dict(self.results)
+        failures = {}
+        pending = collections.OrderedDict(self.tasks)
+        running = {}
+        pools = {"process": processpool(max_workers=workers),
+                 "thread": concurrent.futures.ThreadPoolExecutor(max_workers=workers)}
+        try:
+            while pending or running:
+                for name in list(pending):
+                    task = pending[name]
+                    failed = [dep for dep in task.deps if dep in failures]
+                    if failed and not(task.allow_failed):
+                        failures[name] = DependencyError('{0} failed'.format(failed[0]))
+                        del pending[name]
+                    elif all(dep in results or dep in failures for dep in task.deps):
+                        args = list(task.args) + [results.get(dep) for dep in task.deps]
+                        running[pools[task.pool].submit(task.func, *args)] = name
+                        del pending[name]
+                if not(running):
+                    # Remaining tasks depend on unknown tasks or on each other
+                    for name in pending:
+                        failures[name] = DependencyError('Unresolved dependencies')
+                    break
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as err:
+                        logger.error('Task {0} failed: {1}'.format(name, err))
+                        failures[name] = err
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+        return results, failures
@@ -0,0 +1,58 @@
+# coding: utf-8
+
+import datetime
+import os
+import sys
+import netCDF4
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+
+
+@pytest.fixture
+def synthetic_files(tmp_path):
+    """
+    Three monthly synthetic mooring files, sampled every 10 minutes
+    """
+    filenames = []
+    for ii, month in enumerate([6, 7, 8]):
+        filename = str(tmp_path / "synthetic_2016-{0:02d}.nc".format(month))
+        benchmark.make_synthetic_file(filename, datetime.datetime(2016, month, 1),
+                                      10, 600, seed=ii)
+        filenames.append(filename)
+    return filenames
+
+
+@pytest.fixture
+def make_grid(tmp_path):
+    """
+    Factory of gridded files with the variables `names` (time, lat, lon),
+    of which the values are given by func(lon, lat, time index)
+    """
+    def make(lon, lat, func, ntime=3, names=("sst",), filename="grid.nc"):
+        filename = str(tmp_path / filename)
+        lon, lat = np.asarray(lon), np.asarray(lat)
+        with netCDF4.Dataset(filename, "w") as nc:
+            nc.createDimension("lon", len(lon))
+            nc.createDimension("lat", len(lat))
+            if ntime:
+                nc.createDimension("time", None)
+                time = nc.createVariable("time", "f8", ("time",))
+                time.units = "days since 2016-06-01"
+                time[:] = np.arange(ntime)
+            nc.createVariable("lon", "f8", ("lon",))[:] = lon
+            nc.createVariable("lat", "f8", ("lat",))[:] = lat
+            llon, llat = np.meshgrid(lon, lat)
+            for name in names:
+                dims = ("time", "lat", "lon") if ntime else ("lat", "lon")
+                var = nc.createVariable(name, "f8", dims, fill_value=-999.)
+                if ntime:
+                    for k in range(ntime):
+                        var[k] = func(llon, llat, k)
+                else:
+                    var[:] = func(llon, llat, 0)
+        return filename
+    return make
@@ -0,0 +1,20 @@
+# coding: utf-8
+
+import tracemalloc
+import numpy as np
+import benchmark
+
+
+def test_measure():
+    tracing = []
+
+    def func(size):
+        tracing.append(tracemalloc.is_tracing())
+        return np.ones(size)
+
+    durations, peak, result = benchmark.measure(func, setup=lambda: 1000000, repeat=3)
+    assert len(durations) == 3 and len(result) == 1000000
+    # The timed runs are not traced, the peak comes from a separate run
+    assert tracing == [False, False, False, True]
+    assert peak >= 8000000
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,51 @@
+# coding: utf-8
+
+import os
+import catalog
+
+datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+dapbase = "https://thredds.socib.es/thredds/dodsC/"
+
+
+def test_parse_filename():
+    entry = catalog.parse_filename(
+        "/data/dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2014-06.nc")
+    assert entry[:6] == ("bahiadepalma", "sbe37005", 2, "L1", 2014, 6)
+    assert catalog.parse_filename("/data/README.txt") is None
+
+
+def test_thredds_catalog():
+    mooringcatalog = catalog.Catalog.from_thredds(os.path.join(datadir, "catalog.xml"),
+                                                  dapbase=dapbase)
+    assert len(mooringcatalog) == 5
+    assert mooringcatalog.files("canaldeibiza") == [
+        dapbase + "mooring/canaldeibiza/L1/2016/dep0001_buoy-canaldeibiza_scb-sbe37006_L1_2016-07.nc"]
+
+    entries = mooringcatalog.query("bahiadepalma", start=(2014, 6), months=[6])
+    assert [(entry.level, entry.year, entry.month) for entry in entries] == [("L1", 2014, 6), ("L1", 2015, 6)]
+    entries = mooringcatalog.query("bahiadepalma", end=(2014, 12), level=None)
+    assert sorted(entry.level for entry in entries) == ["L0", "L1", "L1"]
+    assert len(catalog.Catalog.from_thredds(os.path.join(datadir, "catalog.xml"),
+                                            dapbase=dapbase, follow=False)) == 4
+
+
+def test_thredds_service_base():
+    mooringcatalog = catalog.Catalog.from_thredds(os.path.join(datadir, "catalog.xml"),
+                                                  follow=False)
+    assert mooringcatalog.files("bahiadepalma", end=(2014, 6))[0].startswith("/thredds/dodsC/mooring/")
+
+
+def test_directory_and_index(tmp_path):
+    for name in ["dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2014-07.nc",
+                 "dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2014-06.nc",
+                 "dep0002_buoy-bahiadepalma_scb-sbe37005_L0_2014-06.nc",
+                 "notes.txt"]:
+        (tmp_path / name).touch()
+    mooringcatalog = catalog.get_catalog(str(tmp_path), indexfile=str(tmp_path / "index.json"))
+    assert len(mooringcatalog) == 3
+    assert mooringcatalog.files("bahiadepalma") == [
+        str(tmp_path / "dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2014-06.nc"),
+        str(tmp_path / "dep0002_buoy-bahiadepalma_scb-sbe37005_L1_2014-07.nc")]
+
+    saved = catalog.get_catalog("/nonexistent", indexfile=str(tmp_path / "index.json"))
+    assert saved.entries == mooringcatalog.entries
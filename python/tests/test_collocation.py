@@ -0,0 +1,93 @@
+# coding: utf-8
+
+import numpy as np
+import pytest
+import collocation
+import mooring
+import sstOceanColor
+
+
+def linear(lon, lat, k):
+    return 20. + 0.1 * lon + 0.2 * lat + 0.01 * k
+
+
+def station(longitude, latitude):
+    m = mooring.Mooring()
+    m.longitude, m.latitude = longitude, latitude
+    return m
+
+
+def test_axis_weights():
+    i0, i1, weight = collocation.axis_weights(np.array([0., 1., 2.]), np.array([-1., 0.5, 2., 3.]))
+    assert i0.tolist() == [0, 0, 1, 1]
+    assert i1.tolist() == [1, 1, 2, 2]
+    assert weight.tolist() == [0., 0.5, 1., 1.]
+
+
+def test_bilinear_and_nearest(make_grid):
+    # Decreasing latitudes, as in the OceanColor files
+    field = sstOceanColor.sstfield().readfile(
+        make_grid(np.arange(0., 10., 1.), np.arange(50., 30., -1.), linear))
+    stations = {"a": station(2.3, 39.6), "b": station(5., 45.)}
+    values = collocation.Collocation(field, stations).extract("sst", chunksize=2)
+    assert values.shape == (3, 2)
+    assert np.allclose(values[:, 0], linear(2.3, 39.6, np.arange(3)))
+    assert np.allclose(values[:, 1], linear(5., 45., np.arange(3)))
+    nearest = collocation.Collocation(field, stations, method="nearest").extract("sst")
+    assert np.allclose(nearest[:, 0], linear(2., 40., np.arange(3)))
+    field.close()
+
+
+def test_global_wrap(make_grid):
+    field = sstOceanColor.sstfield().readfile(
+        make_grid(np.arange(0., 360., 1.), np.arange(-10., 11., 1.), lambda x, y, k: x))
+    values = collocation.Collocation(field, {"a": station(-0.25, 0.)}).extract("sst")
+    # Between 359 and the first longitude (360)
+    assert np.allclose(values[:, 0], 0.25 * 359.)
+    field.close()
+
+
+def test_outside_regional_grid(make_grid):
+    field = sstOceanColor.sstfield().readfile(
+        make_grid(np.arange(0., 10., 1.), np.arange(30., 50., 1.), linear))
+    stations = {"inside": station(9., 49.), "west": station(-1., 40.),
+                "east": station(9.5, 40.), "south": station(5., 29.)}
+    for method in ["nearest", "bilinear"]:
+        values = collocation.Collocation(field, stations, method).extract("sst")
+        assert np.ma.getmaskarray(values).tolist() == [[False, True, True, True]] * 3
+    field.close()
+
+
+def test_masked_points(make_grid):
+    def land(lon, lat, k):
+        return np.ma.masked_where(lon >= 3., linear(lon, lat, k))
+    field = sstOceanColor.sstfield().readfile(
+        make_grid(np.arange(0., 10., 1.), np.arange(30., 50., 1.), land))
+    values = collocation.Collocation(field, {"coast": station(2.5, 40.),
+                                             "land": station(4., 40.)}).extract("sst")
+    # Only the sea points of the cell are used
+    assert np.allclose(values[:, 0], linear(2., 40., np.arange(3)))
+    assert np.ma.getmaskarray(values[:, 1]).all()
+    field.close()
+
+
+def test_lookup_cache(make_grid):
+    lon, lat = np.arange(0., 10., 1.), np.arange(30., 50., 1.)
+    lookup = collocation.get_lookup(lon, lat, [[2., 40.]])
+    assert collocation.get_lookup(lon, lat, [[2., 40.]]) is lookup
+    assert collocation.get_lookup(lon, lat, [[2., 40.]], "nearest") is not lookup
+    with pytest.raises(ValueError):
+        collocation.get_lookup(lon, lat, [[2., 40.]], "cubic")
+
+
+def test_match(make_grid):
+    field = sstOceanColor.sstfield().readfile(
+        make_grid(np.arange(0., 10., 1.), np.arange(30., 50., 1.), linear))
+    m = station(2., 40.)
+    # One measurement every hour from the second day, 1 degree warmer
+    m.time = field.time[0] + 86400 + 3600 * np.arange(48, dtype=np.int64)
+    m.temperature = np.ma.masked_array(np.full(48, linear(2., 40., 1) + 1.))
+    m.temperatureQF = np.ones(48, dtype=np.int8)
+    result = collocation.Collocation(field, {"a": m}).match("sst", maxdelta=600)
+    assert result["a"]["time"].tolist() == field.time[1:].tolist()
+    assert np.allclose(result["a"]["temperature"] - result["a"]["field"], [1., 0.99])
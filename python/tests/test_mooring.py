@@ -0,0 +1,431 @@
+# coding: utf-8
+
+import concurrent.futures
+import datetime
+import multiprocessing
+import os
+import time
+import matplotlib.pyplot as plt
+import netCDF4
+import numpy as np
+import pytest
+import benchmark
+import mooring
+
+
+def test_from_files_order_and_failures(synthetic_files, tmp_path):
+    missing = str(tmp_path / "missing.nc")
+    file_list = [synthetic_files[2], missing, synthetic_files[0], synthetic_files[1]]
+    moorings, failures = mooring.Mooring.from_files(file_list, workers=2)
+
+    assert list(failures) == [missing]
+    assert moorings[1] is None
+    for filename, m in zip(file_list, moorings):
+        if m is None:
+            continue
+        expected = mooring.Mooring().get_from_nc(filename)
+        assert m.filename == filename
+        np.testing.assert_array_equal(m.time, expected.time)
+        np.testing.assert_array_equal(m.temperature, expected.temperature)
+    assert moorings[0].time[0] > moorings[3].time[0] > moorings[2].time[0]
+
+
+def test_cache_roundtrip(synthetic_files, tmp_path):
+    cache = mooring.MooringCache(str(tmp_path / "cache"))
+    m = mooring.Mooring().get_from_nc(synthetic_files[0], cache=cache)
+    assert synthetic_files[0] in cache
+    # The file of 2016 is complete, the entry does not expire
+    assert cache.index[synthetic_files[0]]["closed"]
+
+    cached = mooring.Mooring().get_from_nc(synthetic_files[0], cache=cache)
+    np.testing.assert_array_equal(cached.time, m.time)
+    for name in mooring.Mooring.variables:
+        np.testing.assert_array_equal(np.ma.getmaskarray(getattr(cached, name)),
+                                      np.ma.getmaskarray(getattr(m, name)))
+        np.testing.assert_array_equal(getattr(cached, name), getattr(m, name))
+
+    # The index is read again by a new cache on the same directory
+    assert synthetic_files[0] in mooring.MooringCache(str(tmp_path / "cache"))
+
+
+def test_cache_eviction_and_expiry(synthetic_files, tmp_path):
+    cache = mooring.MooringCache(str(tmp_path / "cache"))
+    for filename in synthetic_files:
+        cache.put(filename, mooring.Mooring().get_from_nc(filename).get_variables())
+    cache.get(synthetic_files[0])
+    size = max(entry["size"] for entry in cache.index.values())
+
+    # The least recently used entry is removed first
+    cache.maxsize = 2.5 * size
+    cache._evict()
+    assert synthetic_files[1] not in cache
+    assert synthetic_files[0] in cache and synthetic_files[2] in cache
+
+    # Only the entries of the files still being written expire
+    cache.maxage = -1
+    cache.index[synthetic_files[0]]["closed"] = False
+    assert cache.get(synthetic_files[0]) is None
+    assert cache.get(synthetic_files[2]) is not None
+
+
+def test_collection_merge(synthetic_files):
+    moorings = [mooring.Mooring().get_from_nc(filename) for filename in synthetic_files]
+    # Unordered, with a file overlapping the previous ones
+    overlap = moorings[1].window(None, moorings[1].time[10])
+    overlap.temperature = overlap.temperature + 100.
+    collection = mooring.MooringCollection.from_moorings([moorings[2], moorings[0],
+                                                          moorings[1], overlap])
+
+    expected = np.concatenate([m.time for m in moorings])
+    np.testing.assert_array_equal(collection.time, expected)
+    np.testing.assert_array_equal(collection.temperature,
+                                  np.ma.concatenate([m.temperature for m in moorings]))
+    assert sorted(collection.index) == [(2016, 6), (2016, 7), (2016, 8)]
+
+    july = collection.select(2016, 7)
+    np.testing.assert_array_equal(july.time, moorings[1].time)
+    assert np.shares_memory(np.ma.getdata(july.temperature), np.ma.getdata(collection.temperature))
+    assert len(collection.select(2015).time) == 0
+
+
+def test_lazy_read_closes_invalid_file(tmp_path, monkeypatch):
+    filename = str(tmp_path / "invalid.nc")
+    with netCDF4.Dataset(filename, "w") as nc:
+        nc.createDimension("time", 3)
+        nc.createVariable("time", "f8", ("time",)).standard_name = "time"
+    opened = []
+    Dataset = netCDF4.Dataset
+
+    def dataset(*args, **kwargs):
+        opened.append(Dataset(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(mooring.netCDF4, "Dataset", dataset)
+    with pytest.raises(IndexError):
+        mooring.Mooring().get_from_nc(filename, lazy=True)
+    assert not(opened[0].isopen())
+
+
+def test_lazy_read(synthetic_files):
+    m = mooring.Mooring().get_from_nc(synthetic_files[0], lazy=True)
+    assert m._nc.isopen() and not(m._data)
+    expected = mooring.Mooring().get_from_nc(synthetic_files[0])
+    np.testing.assert_array_equal(m.temperature, expected.temperature)
+    m.close()
+
+
+def test_climatology_bins_and_incremental_update(synthetic_files, tmp_path):
+    climatology = mooring.Climatology()
+    dates = [datetime.datetime(2015, 3, 1), datetime.datetime(2016, 3, 1, 12),
+             datetime.datetime(2016, 2, 29), datetime.datetime(2015, 12, 31, 23)]
+    bins = climatology.get_bins(mooring.date2epoch(dates))
+    np.testing.assert_array_equal(bins, [60, 60, 59, 365])
+
+    collection = mooring.MooringCollection.from_files(synthetic_files)[0]
+    with pytest.raises(ValueError):
+        climatology.update(collection)
+    added = climatology.update(collection, source="station")
+    assert added == len(collection.time)
+    filename = str(tmp_path / "climatology.npz")
+    climatology.save(filename)
+    climatology = mooring.Climatology.load(filename)
+    assert climatology.update(collection, source="station") == 0
+    assert climatology.count["temperature"].sum() == collection.temperature.count()
+
+
+def make_series(values, mask=None):
+    m = mooring.Mooring()
+    m.time = 600 * np.arange(len(values), dtype=np.int64)
+    m.temperature = np.ma.masked_array(values, mask=mask)
+    m.temperatureQF = np.ones(len(values), dtype=np.int8)
+    m.salinity = np.ma.masked_array(np.full(len(values), 37.5))
+    m.salinityQF = np.ones(len(values), dtype=np.int8)
+    return m
+
+
+def test_qc_gap_is_not_compared():
+    values = np.full(10, 20.)
+    mask = np.zeros(10, dtype=bool)
+    values[5], mask[5] = -9999., True
+    m = make_series(values, mask)
+    mooring.QCPipeline([mooring.GradientTest(1.), mooring.SpikeTest(1.)]).run(m, ["temperature"])
+    np.testing.assert_array_equal(m.qcmask["temperature"], mask)
+    assert not(m.qcflags["temperature"].any())
+
+
+def test_qc_rejected_neighbour_is_not_compared():
+    values = np.full(10, 20.)
+    values[5] = 50.
+    m = make_series(values)
+    mooring.QCPipeline([mooring.RangeTest(0., 40.), mooring.GradientTest(1.)]).run(m, ["temperature"])
+    np.testing.assert_array_equal(np.flatnonzero(m.qcmask["temperature"]), [5])
+    assert m.qctests["temperature"][m.qcflags["temperature"][5] - 1] == "range"
+
+
+@pytest.mark.parametrize("chunksize", [3, 5, 6, 7, 8, 100])
+def test_qc_chunk_boundaries(chunksize):
+    values = np.array([20, 20.1, 20.2, 20.3, 21, 21, 21, 25, 20.5, 20.6, 20.7, 20.8, 20.9, 21])
+    m = make_series(values)
+    mooring.QCPipeline([mooring.SpikeTest(1.), mooring.StuckValueTest(3)],
+                       chunksize=chunksize).run(m, ["temperature"])
+    np.testing.assert_array_equal(np.flatnonzero(m.qcmask["temperature"]), [4, 5, 6, 7])
+    np.testing.assert_array_equal(m.qcflags["temperature"][4:8], [2, 2, 2, 1])
+
+
+def test_qc_window_does_not_modify_mooring():
+    m = make_series(np.array([20., 20., 30., 20., 30., 20., 20.]))
+    m.temperatureQF[0] = 4
+    m.apply_qc()
+    mask = m.qcmask["temperature"].copy()
+    window = m.window(0, 3000)
+    mooring.QCPipeline([mooring.RangeTest(0., 25.)]).run(window, ["temperature"])
+    np.testing.assert_array_equal(np.flatnonzero(window.qcmask["temperature"]), [0, 2, 4])
+    np.testing.assert_array_equal(m.qcmask["temperature"], mask)
+    np.testing.assert_array_equal(np.ma.getmaskarray(m.temperature), mask)
+    assert not(m.qcflags["temperature"][1:].any())
+    assert m.qctests["temperature"] == ["flag"]
+
+
+def test_qc_chunks(synthetic_files):
+    tests = [mooring.FlagTest(1), mooring.RangeTest(15., 25.), mooring.SpikeTest(0.5),
+             mooring.GradientTest(0.5), mooring.StuckValueTest(3)]
+    whole = mooring.Mooring().get_from_nc(synthetic_files[0])
+    mooring.QCPipeline(tests).run(whole)
+    for chunksize in [7, 100]:
+        chunked = mooring.Mooring().get_from_nc(synthetic_files[0], lazy=True)
+        mooring.QCPipeline(tests, chunksize=chunksize).run(chunked)
+        for name in ["temperature", "salinity"]:
+            np.testing.assert_array_equal(chunked.qcmask[name], whole.qcmask[name])
+            np.testing.assert_array_equal(chunked.qcflags[name], whole.qcflags[name])
+        chunked.close()
+    assert whole.qcmask["temperature"].any() and not(whole.qcmask["temperature"].all())
+
+
+@pytest.mark.parametrize("by", ["month", "dayofyear"])
+def test_statistics(by):
+    rng = np.random.RandomState(0)
+    m = make_series(rng.normal(20., 2., 24 * 60), rng.rand(24 * 60) < 0.2)
+    m.time = mooring.as_epoch(datetime.datetime(2016, 1, 20)) + 3600 * m.time // 600
+    percentiles = (5, 50, 95)
+    statistics = m.get_statistics(by, percentiles=percentiles)
+    keys = m.group_keys(by)
+    assert len(statistics["keys"]) == {"month": 3, "dayofyear": 60}[by]
+    result = statistics["temperature"]
+    for ii, key in enumerate(statistics["keys"]):
+        group = m.temperature[keys == key]
+        time = m.time[keys == key][~np.ma.getmaskarray(group)]
+        values = group.compressed()
+        assert result["count"][ii] == len(values)
+        assert result["min"][ii] == values.min() and result["max"][ii] == values.max()
+        assert np.isclose(result["mean"][ii], values.mean())
+        np.testing.assert_allclose(result["percentiles"][ii], np.percentile(values, percentiles))
+        assert result["datemin"][ii] == time[np.argmin(values)].astype("datetime64[s]")
+        assert result["datemax"][ii] == time[np.argmax(values)].astype("datetime64[s]")
+
+
+def test_statistics_masked_values():
+    m = make_series(np.array([1., 50., 2., np.nan, 3.]), [False, True, False, False, False])
+    m.salinity[:] = np.ma.masked
+    statistics = m.get_statistics(percentiles=(0, 100))
+    assert statistics["temperature"]["count"].tolist() == [3]
+    assert statistics["temperature"]["max"].tolist() == [3.]
+    assert statistics["temperature"]["percentiles"].tolist() == [[1., 3.]]
+    assert statistics["temperature"]["datemax"][0] == np.datetime64(2400, "s")
+    assert statistics["salinity"]["count"].tolist() == [0]
+    assert np.isnan(statistics["salinity"]["mean"][0])
+    assert np.isnat(statistics["salinity"]["datemin"][0])
+
+
+@pytest.mark.parametrize("freq, length", [("hour", 3600), ("day", 86400), ("month", None)])
+@pytest.mark.parametrize("how", ["mean", "min", "max", "count"])
+def test_resample(freq, length, how):
+    rng = np.random.RandomState(1)
+    m = make_series(rng.normal(20., 2., 6 * 24 * 40), rng.rand(6 * 24 * 40) < 0.1)
+    m.time += mooring.as_epoch(datetime.datetime(2016, 1, 15))
+    resampled = m.resample(freq, how)
+    keys = m.group_keys(freq)
+    starts = np.unique(keys).astype("datetime64[s]").astype(np.int64)
+    np.testing.assert_array_equal(resampled.time, starts)
+    if length is not None:
+        assert np.all(np.diff(resampled.time) == length)
+    for ii, key in enumerate(np.unique(keys)):
+        values = m.temperature[keys == key].compressed()
+        expected = len(values) if how == "count" else getattr(np, how)(values)
+        assert np.isclose(resampled.temperature[ii], expected)
+        assert resampled.counts["temperature"][ii] == len(values)
+    assert np.all(resampled.temperatureQF == 1)
+
+
+def test_resample_masked_period():
+    m = make_series(np.arange(12 * 6, dtype=np.float64))
+    m.temperature[6:12] = np.ma.masked
+    m.temperature[13] = np.nan
+    resampled = m.resample("hour", "mean")
+    assert np.ma.getmaskarray(resampled.temperature).tolist() == [False, True] + [False] * 10
+    assert resampled.temperatureQF.tolist() == [1, 9] + [1] * 10
+    assert resampled.counts["temperature"][:3].tolist() == [6, 0, 5]
+    assert resampled.temperature[2] == np.mean([12, 14, 15, 16, 17])
+    with pytest.raises(ValueError):
+        m.resample("week")
+    with pytest.raises(ValueError):
+        m.resample("day", "median")
+
+
+def test_resample_unsorted():
+    m = make_series(np.arange(12, dtype=np.float64))
+    order = np.random.RandomState(2).permutation(12)
+    m.time, m.temperature = 600 * order, m.temperature[order]
+    resampled = m.resample("hour", "min")
+    assert resampled.time.tolist() == [0, 3600]
+    assert resampled.temperature.tolist() == [0., 6.]
+    assert m.resample("hour", "max").temperature.tolist() == [5., 11.]
+
+
+def test_decimate_minmax():
+    rng = np.random.RandomState(3)
+    x = 600 * np.arange(10000, dtype=np.int64)
+    y = np.ma.masked_array(rng.normal(20., 1., 10000))
+    y[2000:2100] = np.ma.masked
+    y[7000] = np.ma.masked
+    xd, yd = mooring.decimate_minmax(x, y, 100)
+    assert len(xd) <= 4 * 100 + 2
+    assert yd.max() == y.max() and yd.min() == y.min()
+    # Each gap still interrupts the line
+    assert xd[np.ma.getmaskarray(yd)].tolist() == [x[2000], x[7000]]
+    assert np.all(np.diff(xd) > 0)
+    # Short series are not decimated
+    xd, yd = mooring.decimate_minmax(x[:400], y[:400], 100)
+    assert len(xd) == 400
+
+
+def test_date2angle():
+    march = [datetime.datetime(2016, 3, 1), datetime.datetime(2017, 3, 1)]
+    angles = mooring.date2angle([mooring.as_epoch(date) for date in march])
+    # 31 + 29 days of 366 in 2016, 31 + 28 days of 365 in 2017
+    np.testing.assert_allclose(angles, [2 * np.pi * 60 / 366, 2 * np.pi * 59 / 365])
+    assert mooring.date2angle(mooring.as_epoch(datetime.datetime(2016, 1, 1))) == 0.
+    last = mooring.date2angle(mooring.as_epoch(datetime.datetime(2017, 12, 31, 23, 59)))
+    assert 2 * np.pi - 1e-4 < last < 2 * np.pi
+
+
+def test_add_to_polar():
+    m = make_series(np.arange(3 * 144, dtype=np.float64))
+    m.time = np.concatenate([mooring.as_epoch(datetime.datetime(year, 12, 31)) + 600 * np.arange(144)
+                             for year in [2015, 2016, 2017]])
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection="polar")
+    m.add_to_polar("temperature", ax, colors={2016: "red"})
+    lines = ax.get_lines()
+    assert [line.get_label() for line in lines] == ["2015", "2016", "2017"]
+    assert [len(line.get_xdata()) for line in lines] == [144, 144, 144]
+    assert lines[1].get_color() == "red"
+    assert all(np.all(line.get_xdata() < 2 * np.pi) for line in lines)
+    plt.close(fig)
+
+
+def test_archive_roundtrip(synthetic_files, tmp_path):
+    collection = mooring.MooringCollection.from_files(synthetic_files)[0]
+    collection.apply_qc()
+    collection.to_archive(str(tmp_path), "station")
+
+    archived = mooring.MooringCollection.from_archive(str(tmp_path), "station")
+    np.testing.assert_array_equal(archived.time, collection.time)
+    assert sorted(archived.index) == sorted(collection.index)
+    for name in mooring.Mooring.variables:
+        np.testing.assert_array_equal(np.ma.getmaskarray(getattr(archived, name)),
+                                      np.ma.getmaskarray(getattr(collection, name)))
+        np.testing.assert_array_equal(np.ma.getdata(getattr(archived, name)),
+                                      np.ma.getdata(getattr(collection, name)).astype(np.float32))
+    assert isinstance(np.ma.getdata(archived.temperature), np.memmap)
+    july = mooring.MooringCollection.from_archive(str(tmp_path), "station", years=[2016], months=[7])
+    np.testing.assert_array_equal(july.time, collection.select(2016, 7).time)
+    assert isinstance(np.ma.getdata(july.temperature), np.memmap)
+    summer = mooring.MooringCollection.from_archive(str(tmp_path), "station", months=[6, 8])
+    np.testing.assert_array_equal(summer.time, np.concatenate([collection.select(2016, 6).time,
+                                                               collection.select(2016, 8).time]))
+
+    assert len(mooring.MooringCollection.from_archive(str(tmp_path), "station", years=[]).time) == 0
+
+
+def test_archive_append(synthetic_files, tmp_path, monkeypatch):
+    collection = mooring.MooringCollection.from_files(synthetic_files)[0]
+    collection.temperature[::7] = np.ma.masked
+    rootdir = str(tmp_path)
+    # Sizes that are not multiple of 8, for the bits of the mask
+    split = len(collection.time) // 3 + 5
+    collection.window(end=collection.time[split - 1]).to_archive(rootdir, "station")
+    saved = []
+    monkeypatch.setattr(np, "save", lambda *args: saved.append(args[0]))
+    collection.window(start=collection.time[split]).to_archive(rootdir, "station", append=True)
+    # The new measurements were appended at the end of the files
+    assert saved == []
+    monkeypatch.undo()
+
+    archived = mooring.MooringCollection.from_archive(rootdir, "station")
+    np.testing.assert_array_equal(archived.time, collection.time)
+    np.testing.assert_array_equal(np.ma.getmaskarray(archived.temperature),
+                                  np.ma.getmaskarray(collection.temperature))
+    np.testing.assert_array_equal(archived.salinityQF, collection.salinityQF)
+
+    # Measurements before the last archived one: the year is merged
+    collection.window(start=collection.time[10], end=collection.time[split + 10]).to_archive(
+        rootdir, "station", append=True)
+    archived = mooring.MooringCollection.from_archive(rootdir, "station")
+    np.testing.assert_array_equal(archived.time, collection.time)
+    np.testing.assert_array_equal(np.ma.getdata(archived.temperature),
+                                  np.ma.getdata(collection.temperature).astype(np.float32))
+
+
+def test_incremental_update(tmp_path):
+    datadir = tmp_path / "data"
+    datadir.mkdir()
+    thismonth = datetime.datetime(*time.gmtime()[:2], 1)
+    pattern = "dep0001_buoy-teststation_scb-sbe37001_L1_{0:%Y-%m}.nc"
+    benchmark.make_synthetic_file(str(datadir / pattern.format(datetime.datetime(2016, 6, 1))),
+                                  datetime.datetime(2016, 6, 1), 5, 600)
+    current = str(datadir / pattern.format(thismonth))
+    benchmark.make_synthetic_file(current, thismonth, 0.5, 600)
+    config = {"catalog": str(datadir), "figdir": str(tmp_path / "plots"), "workers": 1,
+              "archivedir": str(tmp_path / "archive"), "statefile": str(tmp_path / "state.json"),
+              "stations": [{"name": "Test", "station": "teststation", "variables": ["temperature"]}]}
+
+    state = mooring.update(config)
+    assert state["files"][current] == {"lasttime": mooring.as_epoch(thismonth) + 71 * 600,
+                                       "closed": False}
+    june = tmp_path / "archive" / "teststation" / "2016" / "temperature.npy"
+    mtime = os.path.getmtime(str(june))
+    figure = tmp_path / "plots" / "temp_teststation_latest.png"
+    assert figure.exists()
+    figure.unlink()
+
+    # The current file is complete for a longer period
+    benchmark.make_synthetic_file(current, thismonth, 1, 600)
+    mooring.update(config)
+    archived = mooring.MooringCollection.from_archive(config["archivedir"], "teststation")
+    assert len(archived.time) == 5 * 144 + 144
+    assert os.path.getmtime(str(june)) == mtime
+    assert figure.exists()
+
+    figure.unlink()
+    mooring.update(config)
+    assert not(figure.exists())
+
+
+@pytest.mark.parametrize("method", ["fork", "spawn"])
+def test_metrics_of_workers(synthetic_files, tmp_path, monkeypatch, method):
+    monkeypatch.setattr(mooring.metrics, "enabled", True)
+    monkeypatch.setattr(mooring.metrics, "totals", {})
+    missing = str(tmp_path / "missing.nc")
+    context = multiprocessing.get_context(method)
+    with mooring.MetricsProcessPool(2, mp_context=context) as pool:
+        futures = [pool.submit(mooring._read_file, mooring.Mooring, filename)
+                   for filename in synthetic_files + [missing]]
+        concurrent.futures.wait(futures)
+    assert [future.exception() is None for future in futures] == [True, True, True, False]
+    assert futures[0].result().filename == synthetic_files[0]
+
+    totals = mooring.metrics.summary()
+    assert totals["open"]["calls"] == 4
+    assert totals["read_variables"]["calls"] == 3
+    assert totals["read_variables"]["samples"] == 3 * 1440
+    assert "cache" not in totals
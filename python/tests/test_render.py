@@ -0,0 +1,28 @@
+# coding: utf-8
+
+import datetime
+import os
+from matplotlib import dates
+import mooring
+import render
+
+
+def test_render_months(synthetic_files, tmp_path):
+    collection = mooring.MooringCollection.from_files(synthetic_files)[0]
+    renderer = render.Renderer(dpi=50)
+    for monthmin, monthmax in [(None, None), (7, 7), (1, 12)]:
+        job = render.RenderJob("station", "temperature", [2016],
+                               str(tmp_path / "{0}_{1}.png".format(monthmin, monthmax)),
+                               "Title", monthmin, monthmax)
+        assert os.path.exists(renderer.render(collection, job))
+    xlims = [tuple(dates.num2date(x).replace(tzinfo=None) for x in layout[1].get_xlim())
+             for layout in renderer.layouts.values()]
+    assert xlims == [(datetime.datetime(2000, 6, 1), datetime.datetime(2000, 9, 1)),
+                     (datetime.datetime(2000, 7, 1), datetime.datetime(2000, 8, 1)),
+                     (datetime.datetime(2000, 1, 1), datetime.datetime(2001, 1, 1))]
+    renderer.close()
+
+
+def test_station_months():
+    assert mooring._month_range({"months": [8, 6, 7]}) == (6, 8)
+    assert mooring._month_range({}) == (1, 12)
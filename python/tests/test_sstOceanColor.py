@@ -0,0 +1,78 @@
+# coding: utf-8
+
+import numpy as np
+import sstOceanColor
+
+
+def lonlat(lon, lat, k):
+    return lon + 1000. * lat + 0.5 * k
+
+
+def test_lon_slices():
+    lon = np.arange(0., 360., 1.)
+    slices, lonregion = sstOceanColor.lon_slices(lon, -20., 10.)
+    assert slices == [slice(340, 360), slice(0, 11)]
+    assert lonregion.tolist() == list(np.arange(-20., 11., 1.))
+
+
+def test_read_block_wraparound(make_grid):
+    field = sstOceanColor.sstfield().readfile(
+        make_grid(np.arange(0., 360., 1.), np.arange(-10., 11., 1.), lonlat))
+    values = field.read_block("sst", 1, (-20., 10., -2., 2.))
+    lon = np.mod(np.arange(-20., 11., 1.), 360.)
+    expected = lonlat(*np.meshgrid(lon, np.arange(-2., 3., 1.)), k=1)
+    assert values.shape == (5, 31)
+    assert np.allclose(values, expected)
+    field.close()
+
+
+def test_read_block_decreasing_latitudes(make_grid):
+    lon, lat = np.arange(0., 10., 1.), np.arange(50., 29., -1.)
+    field = sstOceanColor.sstfield().readfile(make_grid(lon, lat, lonlat))
+    _, _, lonregion, latregion = field.get_slices((2., 4., 35., 40.))
+    assert latregion.tolist() == list(range(35, 41))
+    values = field.read_block("sst", slice(0, 2), (2., 4., 35., 40.))
+    assert values.shape == (2, 6, 3)
+    assert np.allclose(values[1], lonlat(*np.meshgrid(lonregion, latregion), k=1))
+    # One point out of two, the latitudes still increasing
+    values = field.read_block("sst", 0, step=2)
+    assert np.allclose(values, lonlat(*np.meshgrid(lon[::2], np.sort(lat[::2])), k=0))
+    field.close()
+
+
+def test_mean_and_anomaly(make_grid):
+    field = sstOceanColor.sstfield().readfile(
+        make_grid(np.arange(0., 10., 1.), np.arange(30., 40., 1.), lonlat, ntime=5))
+    domain = (1., 3., 32., 35.)
+    mean = field.get_mean("sst", domain, chunksize=2)
+    llon, llat = np.meshgrid(np.arange(1., 4., 1.), np.arange(32., 36., 1.))
+    assert np.allclose(mean, lonlat(llon, llat, 2))
+    field.extractime(2016, 6, 5)
+    assert field.timeindex == 4
+    assert np.allclose(field.get_anomaly("sst", domain, chunksize=3), 1.)
+    field.close()
+
+
+def test_no_time(make_grid):
+    field = sstOceanColor.sstfield().readfile(
+        make_grid(np.arange(0., 10., 1.), np.arange(30., 40., 1.), lonlat, ntime=0))
+    mean = field.get_mean("sst", (1., 3., 32., 35.))
+    assert np.allclose(mean, lonlat(*np.meshgrid(np.arange(1., 4., 1.), np.arange(32., 36., 1.)), k=0))
+    assert np.allclose(field.get_anomaly("sst", (1., 3., 32., 35.)), 0.)
+    field.close()
+
+
+def test_wind_speed(make_grid):
+    def wind(lon, lat, k):
+        return np.ma.masked_where(lon > 8., 3. + 0. * lon)
+    field = sstOceanColor.windfield().readfile(
+        make_grid(np.arange(0., 10., 1.), np.arange(30., 40., 1.), wind, names=("u", "v")))
+    speed = field.read_block("speed", 0, (-2., 9., 30., 35.))
+    assert speed.shape == (6, 10)
+    assert np.allclose(speed.compressed(), 3. * np.sqrt(2.))
+    assert np.ma.getmaskarray(speed)[:, -1].all() and not np.ma.getmaskarray(speed)[:, :-1].any()
+    field.extractdomain((-2., 9., 30., 35.))
+    assert np.allclose(field.speedregion, speed)
+    assert field.lonregion.tolist() == list(range(0, 10))
+    assert np.allclose(field.get_mean("speed", (0., 2., 30., 31.)), 3. * np.sqrt(2.))
+    field.close()
@@ -0,0 +1,56 @@
+# coding: utf-8
+
+import operator
+import pytest
+import tasks
+
+
+def fail(*args):
+    raise RuntimeError("failed")
+
+
+def describe(*args):
+    return args
+
+
+def test_results_of_dependencies():
+    graph = tasks.TaskGraph()
+    graph.add("a", operator.add, 1, 2)
+    graph.add("b", operator.mul, 10, deps=["a"], pool="thread")
+    graph.add_result("c", 5)
+    graph.add("d", describe, "x", deps=["b", "c"], pool="thread")
+    results, failures = graph.run(workers=2)
+    assert failures == {}
+    assert results == {"a": 3, "b": 30, "c": 5, "d": ("x", 30, 5)}
+    assert "c" in graph
+    with pytest.raises(ValueError):
+        graph.add_result("a", 0)
+    with pytest.raises(ValueError):
+        graph.add("c", describe)
+
+
+def test_failure_propagation():
+    graph = tasks.TaskGraph()
+    graph.add("a", fail, pool="thread")
+    graph.add("b", describe, deps=["a"], pool="thread")
+    graph.add("c", describe, deps=["b"], pool="thread")
+    graph.add("d", describe, "d", deps=["a", "b"], pool="thread", allow_failed=True)
+    graph.add("e", describe, "e", pool="thread")
+    results, failures = graph.run(workers=2)
+    assert isinstance(failures["a"], RuntimeError)
+    assert isinstance(failures["b"], tasks.DependencyError)
+    assert isinstance(failures["c"], tasks.DependencyError)
+    # The failed dependencies are passed as None
+    assert results == {"d": ("d", None, None), "e": ("e",)}
+
+
+def test_unresolved_dependencies():
+    graph = tasks.TaskGraph()
+    graph.add("a", describe, deps=["unknown"], pool="thread")
+    graph.add("b", describe, deps=["c"], pool="thread")
+    graph.add("c", describe, deps=["b"], pool="thread")
+    graph.add("d", describe, pool="thread")
+    results, failures = graph.run(workers=1)
+    assert results == {"d": ()}
+    assert sorted(failures) == ["a", "b", "c"]
+    assert all(isinstance(err, tasks.DependencyError) for err in failures.values())